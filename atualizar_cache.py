@@ -1,11 +1,31 @@
 import psycopg2
+from psycopg2.extras import execute_values
 import requests
 import time
+import threading
+from collections import deque
+from contextlib import nullcontext
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
 import os
-from datetime import datetime
+import random
+import uuid
+import re
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from dateutil import parser 
 from dotenv import load_dotenv
 
+from metricas import bitrix_http, registro
+from snapshot import (
+    aplicar_no_snapshot,
+    invalidar_snapshot,
+    publicar_snapshot,
+    snapshot_atual,
+)
+
 load_dotenv()
 # Parâmetros banco
 DB_PARAMS = {
@@ -15,26 +35,34 @@ DB_PARAMS = {
     "host": os.getenv("DB_HOST"),
     "port": os.getenv("DB_PORT"),
 }
+# Base "geral" consultada pela API ao lado da tabela bitrix.
+DB_PARAMS_MATEUS = {
+    "dbname": os.getenv("DB_NAME_MATEUS"),
+    "user": os.getenv("DB_USER_MATEUS"),
+    "password": os.getenv("DB_PASSWORD_MATEUS"),
+    "host": os.getenv("DB_HOST_MATEUS"),
+    "port": os.getenv("DB_PORT_MATEUS"),
+}
 
-WEBHOOKS = [
-    "https://marketingsolucoes.bitrix24.com.br/rest/5332/8zyo7yj1ry4k59b5/crm.deal.list",
-    "https://marketingsolucoes.bitrix24.com.br/rest/5332/y5q6wd4evy5o57ze/crm.deal.list",
-]
+# Portal e tokens de webhook; sobrescrevíveis para apontar para um Bitrix falso
+# (ver benchmarks/fake_bitrix.py).
+BITRIX_PORTAL = os.getenv(
+    "BITRIX_PORTAL", "https://marketingsolucoes.bitrix24.com.br/rest/5332"
+)
+BITRIX_TOKENS = os.getenv("BITRIX_TOKENS", "8zyo7yj1ry4k59b5,y5q6wd4evy5o57ze").split(",")
+
+WEBHOOKS = [f"{BITRIX_PORTAL}/{token}/crm.deal.list" for token in BITRIX_TOKENS]
 
 # Webhooks para pegar categorias e estágios
 WEBHOOK_CATEGORIES = [
-    "https://marketingsolucoes.bitrix24.com.br/rest/5332/8zyo7yj1ry4k59b5/crm.dealcategory.list",
-    "https://marketingsolucoes.bitrix24.com.br/rest/5332/y5q6wd4evy5o57ze/crm.dealcategory.list",
+    f"{BITRIX_PORTAL}/{token}/crm.dealcategory.list" for token in BITRIX_TOKENS
 ]
 
 WEBHOOK_STAGES = [
-    "https://marketingsolucoes.bitrix24.com.br/rest/5332/8zyo7yj1ry4k59b5/crm.dealcategory.stage.list",
-    "https://marketingsolucoes.bitrix24.com.br/rest/5332/y5q6wd4evy5o57ze/crm.dealcategory.stage.list",
+    f"{BITRIX_PORTAL}/{token}/crm.dealcategory.stage.list" for token in BITRIX_TOKENS
 ]
 
 
-
-
 PARAMS = {
     "select[]": [
         "ID",
@@ -60,21 +88,144 @@ PARAMS = {
         "UF_CRM_1698761151613",  # Data de instalação
         "UF_CRM_1699452141037",  # Quais operadoras tem viabilidade?
         "DATE_CREATE",
+        "DATE_MODIFY",
     ],
     "filter[>=DATE_CREATE]": "2021-01-01",
+    # Ordem por ID: o checkpoint retoma com filter[>ID] a partir do último gravado.
+    "order[ID]": "ASC",
     "start": 0,
 }
 
 MAX_RETRIES = 20
-RETRY_DELAY = 30
-REQUEST_DELAY = 2
-PAGE_DELAY = 30
-LIMITE_REGISTROS_TURBO = 20000
+
+# Limitador adaptativo por token (ver LimitadorAdaptativo).
+BITRIX_RPS_INICIAL = float(os.getenv("BITRIX_RPS_INICIAL", 1))
+BITRIX_RPS_MAX = float(os.getenv("BITRIX_RPS_MAX", 2))
+BITRIX_RAJADA = int(os.getenv("BITRIX_RAJADA", 10))
+BITRIX_BACKOFF_MAX = float(os.getenv("BITRIX_BACKOFF_MAX", 60))
+BITRIX_AUMENTO_RPS = 0.1
+# O Bitrix limita o tempo de execução ("operating") a 480s por método a cada 10 min.
+BITRIX_OPERATING_LIMITE = 480
+TAMANHO_PAGINA = 50
+# Páginas buscadas em paralelo: por padrão uma thread por token de webhook.
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", len(WEBHOOKS)))
+# Páginas de crm.deal.list empacotadas em cada chamada ao método batch (máx. 50).
+PAGINAS_POR_BATCH = int(os.getenv("PAGINAS_POR_BATCH", 50))
+BATCH_MAX_COMANDOS = 50
+# Lotes buscados à frente da gravação: limita quantos deals ficam em memória.
+SYNC_JANELA = int(os.getenv("SYNC_JANELA", SYNC_WORKERS * 2))
+BATCH_RETRIES = 3
+
+SNAPSHOT_PUBLICAR = os.getenv("SNAPSHOT_PUBLICAR", "1") == "1"
+# Arquivo .prom (textfile collector) gravado ao fim de cada sync.
+METRICAS_ARQUIVO = os.getenv("METRICAS_ARQUIVO")
+
+bitrix_espera = registro.histograma(
+    "cep_bitrix_espera_segundos", "Espera no limitador antes de chamar o Bitrix."
+)
+sync_etapa = registro.histograma(
+    "cep_sync_etapa_segundos",
+    "Duração de cada etapa do sync, por página (busca: por lote batch).",
+    ("etapa",),
+)
+sync_deals = registro.contador(
+    "cep_sync_deals_total",
+    "Deals processados pelo sync, por resultado da gravação.",
+    ("resultado",),
+)
+
+# Chave em sync_estado com o maior DATE_MODIFY já coberto por um sync concluído.
+CHAVE_MARCA_DATE_MODIFY = "marca_date_modify"
+# Contador incrementado a cada commit de dados; a API escuta o canal e
+# descarta o cache de resultados quando ele muda.
+CHAVE_VERSAO_DADOS = "versao_dados"
+# Progresso do sync em andamento, gravado junto com cada página.
+CHAVE_CHECKPOINT = "checkpoint_sync"
+CANAL_VERSAO_DADOS = "versao_dados"
 
 
 def get_conn():
     return psycopg2.connect(**DB_PARAMS)
 
+
+def normalizar_cep(cep):
+    digitos = re.sub(r"\D", "", str(cep or ""))
+    return digitos or None
+
+
+def garantir_schema(conn):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'bitrix' AND column_name = 'cep_normalizado';
+            """
+        )
+        if cur.fetchone() is None:
+            print("🛠️ Criando coluna cep_normalizado...")
+            cur.execute("ALTER TABLE bitrix ADD COLUMN cep_normalizado TEXT;")
+            cur.execute(
+                """
+                UPDATE bitrix
+                SET cep_normalizado = NULLIF(regexp_replace(uf_crm_cep, '[^0-9]', '', 'g'), '');
+                """
+            )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_bitrix_cep_normalizado ON bitrix (cep_normalizado);"
+        )
+        # Linhas antigas ficam com hash NULL e são regravadas uma vez.
+        cur.execute("ALTER TABLE bitrix ADD COLUMN IF NOT EXISTS hash_conteudo TEXT;")
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sync_estado (
+                chave TEXT PRIMARY KEY,
+                valor TEXT,
+                atualizado_em TIMESTAMP NOT NULL DEFAULT now()
+            );
+            """
+        )
+    conn.commit()
+
+
+def ler_estado(conn, chave):
+    with conn.cursor() as cur:
+        cur.execute("SELECT valor FROM sync_estado WHERE chave = %s;", (chave,))
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def gravar_estado(conn, chave, valor):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO sync_estado (chave, valor, atualizado_em)
+            VALUES (%s, %s, now())
+            ON CONFLICT (chave) DO UPDATE SET
+                valor = EXCLUDED.valor,
+                atualizado_em = EXCLUDED.atualizado_em;
+            """,
+            (chave, valor),
+        )
+
+
+def incrementar_versao_dados(conn):
+    # Vai na mesma transação dos dados: o NOTIFY só é entregue no commit.
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO sync_estado (chave, valor, atualizado_em)
+            VALUES (%s, '1', now())
+            ON CONFLICT (chave) DO UPDATE SET
+                valor = (sync_estado.valor::bigint + 1)::text,
+                atualizado_em = EXCLUDED.atualizado_em
+            RETURNING valor;
+            """,
+            (CHAVE_VERSAO_DADOS,),
+        )
+        versao = cur.fetchone()[0]
+        cur.execute("SELECT pg_notify(%s, %s);", (CANAL_VERSAO_DADOS, versao))
+    return versao
+
 def format_date(date_str):
     if not date_str:
         return None
@@ -84,95 +235,330 @@ def format_date(date_str):
 
 
 
-def upsert_deal(conn, deal):
+COLUNAS_BITRIX = [
+    "id",
+    "title",
+    "stage_id",
+    "category_id",
+    "uf_crm_cep",
+    "uf_crm_contato",
+    "date_create",
+    "contato01",
+    "contato02",
+    "ordem_de_servico",
+    "nome_do_cliente",
+    "nome_da_mae",
+    "data_de_vencimento",
+    "email",
+    "cpf",
+    "rg",
+    "referencia",
+    "rua",
+    "data_de_instalacao",
+    "quais_operadoras_tem_viabilidade",
+    "uf_crm_bairro",
+    "uf_crm_cidade",
+    "uf_crm_numero",
+    "uf_crm_uf",
+    "cep_normalizado",
+    "hash_conteudo",
+]
+
+# Deal sem mudança não é reescrito: o WHERE evita a nova versão da linha (WAL,
+# bloat, autovacuum) e o RETURNING só devolve o que foi inserido ou alterado.
+SQL_UPSERT = (
+    f"INSERT INTO bitrix ({', '.join(COLUNAS_BITRIX)}) VALUES %s "
+    "ON CONFLICT (id) DO UPDATE SET "
+    + ", ".join(f"{c} = EXCLUDED.{c}" for c in COLUNAS_BITRIX[1:])
+    + " WHERE bitrix.hash_conteudo IS DISTINCT FROM EXCLUDED.hash_conteudo"
+    " RETURNING id"
+)
+
+BATCH_UPSERT = int(os.getenv("BATCH_UPSERT", 500))
+
+
+def valores_deal(deal):
+    return (
+        deal.get("ID"),
+        deal.get("TITLE"),
+        deal.get("STAGE_ID"),
+        deal.get("CATEGORY_ID"),
+        deal.get("UF_CRM_1700661314351"),  # uf_crm_cep
+        deal.get("CONTACT_ID"),  # uf_crm_contato
+        deal.get("DATE_CREATE"),
+        deal.get("UF_CRM_1698698407472"),  # contato01
+        deal.get("UF_CRM_1698698858832"),  # contato02
+        deal.get("UF_CRM_1697653896576"),  # ordem de serviço
+        deal.get("UF_CRM_1697762313423"),  # nome do cliente
+        deal.get("UF_CRM_1697763267151"),  # nome da mãe
+        deal.get("UF_CRM_1697764091406"),  # vencimento
+        deal.get("UF_CRM_1697807340141"),  # email
+        deal.get("UF_CRM_1697807353336"),  # cpf
+        deal.get("UF_CRM_1697807372536"),  # rg
+        deal.get("UF_CRM_1697808018193"),  # referencia
+        deal.get("UF_CRM_1698688252221"),  # rua
+        deal.get("UF_CRM_1698761151613"),  # data de instalação
+        deal.get("UF_CRM_1699452141037"),  # operadoras viáveis
+        deal.get("UF_CRM_1700661287551"),  # bairro
+        deal.get("UF_CRM_1731588487"),     # cidade
+        deal.get("UF_CRM_1700661252544"),  # número
+        deal.get("UF_CRM_1731589190"),     # uf
+        normalizar_cep(deal.get("UF_CRM_1700661314351")),
+    )
+
+
+def hash_conteudo(valores):
+    # Estável entre execuções: só depende dos valores gravados, na ordem das colunas.
+    dados = json.dumps(valores, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.blake2b(dados.encode(), digest_size=16).hexdigest()
+
+
+def upsert_deals(conn, deals, page_size=BATCH_UPSERT):
+    """Grava os deals e devolve ``(alterados, inalterados)``.
+
+    Um INSERT multi-linha por lote. O mesmo ID não pode aparecer duas vezes
+    no mesmo comando ON CONFLICT, então fica só a última versão de cada deal.
+    """
+    por_id = {deal.get("ID"): deal for deal in deals}
+    linhas = []
+    for deal in por_id.values():
+        valores = valores_deal(deal)
+        linhas.append(valores + (hash_conteudo(valores),))
+    if not linhas:
+        return 0, 0
     with conn.cursor() as cur:
-        cur.execute(
-            """
-            INSERT INTO bitrix (
-                id, title, stage_id, category_id, uf_crm_cep, uf_crm_contato, date_create,
-                contato01, contato02, ordem_de_servico, nome_do_cliente, nome_da_mae,
-                data_de_vencimento, email, cpf, rg, referencia, rua, data_de_instalacao,
-                quais_operadoras_tem_viabilidade,
-                uf_crm_bairro, uf_crm_cidade, uf_crm_numero, uf_crm_uf
+        alterados = len(execute_values(cur, SQL_UPSERT, linhas, page_size=page_size, fetch=True))
+    return alterados, len(linhas) - alterados
+
+
+def upsert_deal(conn, deal):
+    upsert_deals(conn, [deal])
+
+
+def backoff_com_jitter(tentativa):
+    # Exponencial (2, 4, 8... s) até BITRIX_BACKOFF_MAX, sorteado entre a
+    # metade e o teto para os workers não voltarem todos juntos.
+    teto = min(BITRIX_BACKOFF_MAX, 2 ** tentativa)
+    return random.uniform(teto / 2, teto)
+
+
+def segundos_retry_after(valor):
+    # Retry-After vem em segundos ou como data HTTP; valor ilegível é ignorado.
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        data = parsedate_to_datetime(valor)
+    except (TypeError, ValueError):
+        return None
+    if data.tzinfo is None:
+        data = data.replace(tzinfo=timezone.utc)
+    return max(0.0, (data - datetime.now(timezone.utc)).total_seconds())
+
+
+class LimitadorAdaptativo:
+    """Token bucket por token de webhook, compartilhado entre threads.
+
+    A taxa sobe aos poucos enquanto o Bitrix responde bem e cai pela metade a
+    cada 429/503 ou quando o ``time.operating`` da resposta se aproxima do
+    limite. Throttles seguidos pausam o token com backoff exponencial e jitter.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._estados = {}
+
+    def _estado(self, chave):
+        if chave not in self._estados:
+            self._estados[chave] = {
+                "taxa": BITRIX_RPS_INICIAL,
+                "tat": 0.0,
+                "bloqueado_ate": 0.0,
+                "throttles_seguidos": 0,
+                "throttles": 0,
+                "requisicoes": 0,
+            }
+        return self._estados[chave]
+
+    def reiniciar(self):
+        with self._lock:
+            self._estados.clear()
+
+    def aguardar(self, chave):
+        with self._lock:
+            estado = self._estado(chave)
+            agora = time.monotonic()
+            intervalo = 1 / estado["taxa"]
+            liberado = max(
+                agora,
+                estado["tat"] - BITRIX_RAJADA * intervalo,
+                estado["bloqueado_ate"],
             )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (id) DO UPDATE SET
-                title = EXCLUDED.title,
-                stage_id = EXCLUDED.stage_id,
-                category_id = EXCLUDED.category_id,
-                uf_crm_cep = EXCLUDED.uf_crm_cep,
-                uf_crm_contato = EXCLUDED.uf_crm_contato,
-                date_create = EXCLUDED.date_create,
-                contato01 = EXCLUDED.contato01,
-                contato02 = EXCLUDED.contato02,
-                ordem_de_servico = EXCLUDED.ordem_de_servico,
-                nome_do_cliente = EXCLUDED.nome_do_cliente,
-                nome_da_mae = EXCLUDED.nome_da_mae,
-                data_de_vencimento = EXCLUDED.data_de_vencimento,
-                email = EXCLUDED.email,
-                cpf = EXCLUDED.cpf,
-                rg = EXCLUDED.rg,
-                referencia = EXCLUDED.referencia,
-                rua = EXCLUDED.rua,
-                data_de_instalacao = EXCLUDED.data_de_instalacao,
-                quais_operadoras_tem_viabilidade = EXCLUDED.quais_operadoras_tem_viabilidade,
-                uf_crm_bairro = EXCLUDED.uf_crm_bairro,
-                uf_crm_cidade = EXCLUDED.uf_crm_cidade,
-                uf_crm_numero = EXCLUDED.uf_crm_numero,
-                uf_crm_uf = EXCLUDED.uf_crm_uf;
-            """,
-            (
-                deal.get("ID"),
-                deal.get("TITLE"),
-                deal.get("STAGE_ID"),
-                deal.get("CATEGORY_ID"),
-                deal.get("UF_CRM_1700661314351"),  # uf_crm_cep
-                deal.get("CONTACT_ID"),  # uf_crm_contato
-                deal.get("DATE_CREATE"),
-                deal.get("UF_CRM_1698698407472"),  # contato01
-                deal.get("UF_CRM_1698698858832"),  # contato02
-                deal.get("UF_CRM_1697653896576"),  # ordem de serviço
-                deal.get("UF_CRM_1697762313423"),  # nome do cliente
-                deal.get("UF_CRM_1697763267151"),  # nome da mãe
-                deal.get("UF_CRM_1697764091406"),  # vencimento
-                deal.get("UF_CRM_1697807340141"),  # email
-                deal.get("UF_CRM_1697807353336"),  # cpf
-                deal.get("UF_CRM_1697807372536"),  # rg
-                deal.get("UF_CRM_1697808018193"),  # referencia
-                deal.get("UF_CRM_1698688252221"),  # rua
-                deal.get("UF_CRM_1698761151613"),  # data de instalação
-                deal.get("UF_CRM_1699452141037"),  # operadoras viáveis
-                deal.get("UF_CRM_1700661287551"),  # bairro
-                deal.get("UF_CRM_1731588487"),     # cidade
-                deal.get("UF_CRM_1700661252544"),  # número
-                deal.get("UF_CRM_1731589190"),     # uf
-            ),
+            estado["tat"] = max(estado["tat"], liberado) + intervalo
+        if liberado > agora:
+            time.sleep(liberado - agora)
+
+    def registrar_sucesso(self, chave, data):
+        tempo = data.get("time") if isinstance(data, dict) else None
+        operating = float((tempo or {}).get("operating") or 0)
+        with self._lock:
+            estado = self._estado(chave)
+            estado["throttles_seguidos"] = 0
+            estado["requisicoes"] += 1
+            if operating > BITRIX_OPERATING_LIMITE * 0.8:
+                estado["taxa"] = max(1 / BITRIX_BACKOFF_MAX, estado["taxa"] / 2)
+            else:
+                estado["taxa"] = min(BITRIX_RPS_MAX, estado["taxa"] + BITRIX_AUMENTO_RPS)
+            taxa = estado["taxa"]
+            logar = estado["requisicoes"] % 50 == 0
+        if logar:
+            print(f"⚙️ Taxa {chave[-6:]}: {taxa:.2f} req/s (operating {operating:.1f}s)")
+
+    def registrar_throttle(self, chave, retry_after=None):
+        with self._lock:
+            estado = self._estado(chave)
+            estado["throttles_seguidos"] += 1
+            estado["throttles"] += 1
+            estado["taxa"] = max(1 / BITRIX_BACKOFF_MAX, estado["taxa"] / 2)
+            espera = max(retry_after or 0, backoff_com_jitter(estado["throttles_seguidos"]))
+            estado["bloqueado_ate"] = time.monotonic() + espera
+            taxa = estado["taxa"]
+            total = estado["throttles"]
+        print(
+            f"🐢 Throttle #{total} em {chave[-6:]}: taxa {taxa:.2f} req/s, pausa {espera:.1f}s"
         )
 
-def fazer_requisicao(webhooks, params):
+    def info(self):
+        with self._lock:
+            return {
+                chave[-6:]: {k: estado[k] for k in ("taxa", "throttles", "requisicoes")}
+                for chave, estado in self._estados.items()
+            }
+
+
+limitador = LimitadorAdaptativo()
+
+
+def token_webhook(webhook):
+    return webhook.rsplit("/", 1)[0]
+
+
+def webhooks_rotacionados(webhooks, indice):
+    # Distribui as páginas entre os tokens; os demais ficam como failover.
+    n = indice % len(webhooks)
+    return webhooks[n:] + webhooks[:n]
+
+
+def fazer_requisicao(webhooks, params, post=False, timeout=None):
     for webhook in webhooks:
         try:
-            resp = requests.get(webhook, params=params, timeout=30)
-            if resp.status_code == 429:
-                retry_after = int(resp.headers.get("Retry-After", 1))
-                print(
-                    f"⏳ Limite de requisições atingido: aguardando {retry_after}s..."
+            token = token_webhook(webhook)
+            metodo = webhook.rsplit("/", 1)[-1]
+            with bitrix_espera.cronometrar():
+                limitador.aguardar(token)
+            inicio = time.perf_counter()
+            status = "erro"
+            try:
+                if post:
+                    resp = requests.post(webhook, data=params, timeout=timeout or 60)
+                else:
+                    resp = requests.get(webhook, params=params, timeout=timeout or 30)
+                status = str(resp.status_code)
+            finally:
+                bitrix_http.observar(time.perf_counter() - inicio, metodo, status)
+            # O Bitrix sinaliza QUERY_LIMIT_EXCEEDED com 503; versões novas usam 429.
+            if resp.status_code in (429, 503):
+                limitador.registrar_throttle(
+                    token, segundos_retry_after(resp.headers.get("Retry-After"))
                 )
-                time.sleep(retry_after)
                 continue
             resp.raise_for_status()
             print(f"✅ Sucesso com {webhook}")
-            return resp.json()
+            data = resp.json()
+            limitador.registrar_sucesso(token, data)
+            return data
         except Exception as e:
             print(f"❌ Erro com {webhook}: {e}")
             continue
     print("🚫 Todos os webhooks falharam.")
     return None
 
+BITRIX_BASES = [token_webhook(w) for w in WEBHOOKS]
+
+
+def montar_comando(metodo, params):
+    if not params:
+        return metodo
+    return f"{metodo}?{urlencode(params, doseq=True)}"
+
+
+def _como_dict(valor):
+    # O PHP do Bitrix serializa arrays associativos vazios como [].
+    return valor if isinstance(valor, dict) else {}
+
+
+def executar_batch(comandos, bases=BITRIX_BASES, tentativas=BATCH_RETRIES, timeout=None):
+    """Executa ``{chave: (metodo, params)}`` pelo método ``batch`` do Bitrix.
+
+    Empacota até 50 sub-chamadas por requisição. Retorna ``(resultados, erros)``:
+    cada resultado tem ``result``/``total``/``next`` como numa chamada avulsa, e
+    comandos que continuam falhando após ``tentativas`` envios vão para ``erros``.
+    ``timeout`` vale para cada requisição HTTP (padrão do fazer_requisicao).
+    """
+    resultados = {}
+    erros = {}
+    pendentes = dict(comandos)
+    for tentativa in range(1, tentativas + 1):
+        if not pendentes:
+            break
+        if tentativa > 1:
+            espera = backoff_com_jitter(tentativa - 1)
+            print(f"⏳ Reenviando {len(pendentes)} comandos do batch em {espera:.1f}s...")
+            time.sleep(espera)
+
+        erros = {}
+        chaves = list(pendentes)
+        for i in range(0, len(chaves), BATCH_MAX_COMANDOS):
+            grupo = chaves[i : i + BATCH_MAX_COMANDOS]
+            params = {"halt": 0}
+            for chave in grupo:
+                params[f"cmd[{chave}]"] = montar_comando(*pendentes[chave])
+            data = fazer_requisicao(
+                [f"{b}/batch" for b in bases], params, post=True, timeout=timeout
+            )
+            if data is None:
+                for chave in grupo:
+                    erros[chave] = "batch sem resposta"
+                continue
+
+            corpo = _como_dict(data.get("result"))
+            res = _como_dict(corpo.get("result"))
+            res_erro = _como_dict(corpo.get("result_error"))
+            totais = _como_dict(corpo.get("result_total"))
+            proximos = _como_dict(corpo.get("result_next"))
+            for chave in grupo:
+                if chave in res_erro or chave not in res:
+                    erros[chave] = res_erro.get(chave, "sem resultado")
+                    continue
+                resultados[chave] = {
+                    "result": res[chave],
+                    "total": totais.get(chave),
+                    "next": proximos.get(chave),
+                }
+        pendentes = {chave: pendentes[chave] for chave in erros}
+
+    for chave, erro in erros.items():
+        print(f"❌ Comando {chave} do batch falhou: {erro}")
+    return resultados, erros
+
+
 def get_operadora_map():
     try:
         resp = requests.get(
-            "https://marketingsolucoes.bitrix24.com.br/rest/5332/8zyo7yj1ry4k59b5/crm.deal.fields"
+            f"{BITRIX_PORTAL}/{BITRIX_TOKENS[0]}/crm.deal.fields", timeout=30
         )
         data = resp.json()
         items = data.get("result", {}).get("UF_CRM_1699452141037", {}).get("items", [])
@@ -198,11 +584,11 @@ def get_categories():
     return categories
 
 
-def get_stages(category_id):
+def get_stages(category_id, timeout=None):
     params = {"id": category_id, "start": 0}
     stages = {}
     while True:
-        data = fazer_requisicao(WEBHOOK_STAGES, params)
+        data = fazer_requisicao(WEBHOOK_STAGES, params, timeout=timeout)
         if data is None:
             print(f"🚫 Falha ao obter estágios para categoria {category_id}")
             break
@@ -218,85 +604,435 @@ def get_stages(category_id):
     return stages
 
 
-def baixar_todos_dados():
-    conn = get_conn()
-    conn.autocommit = False
-    todos = []
-    local_params = PARAMS.copy()
-    tentativas = 0
+def get_stages_em_lote(category_ids, tentativas=BATCH_RETRIES, timeout=None):
+    comandos = {
+        f"s{cat_id}": ("crm.dealcategory.stage.list", {"id": cat_id})
+        for cat_id in category_ids
+    }
+    resultados, erros = executar_batch(
+        comandos, tentativas=tentativas, timeout=timeout
+    )
+    stages = {}
+    for cat_id in category_ids:
+        resultado = resultados.get(f"s{cat_id}")
+        if resultado is None:
+            continue
+        if resultado.get("next"):
+            # Raro: mais de 50 estágios, pagina pelo caminho avulso.
+            stages[cat_id] = get_stages(cat_id, timeout=timeout)
+            continue
+        stages[cat_id] = {
+            stage["STATUS_ID"]: stage["NAME"] for stage in resultado["result"] or []
+        }
+    falhas = [chave[1:] for chave in erros]
+    return stages, falhas
+
+
+def obter_marca_atual():
+    # Maior DATE_MODIFY no Bitrix no início do sync. Tudo alterado depois disso
+    # fica para o próximo incremental, mesmo que o walk atual já tenha passado.
+    params = {
+        "select[]": ["ID", "DATE_MODIFY"],
+        "order[DATE_MODIFY]": "DESC",
+        "start": -1,
+    }
+    data = fazer_requisicao(WEBHOOKS, params)
+    if not data or not data.get("result"):
+        return None
+    return data["result"][0].get("DATE_MODIFY")
+
 
+def carregar_metadados():
+    """Devolve ``(categorias, estagios_por_categoria, operadora_map)`` para traduzir_deal."""
     print("🚀 Buscando operadoras dinamicamente...")
     operadora_map = get_operadora_map()
 
-
     print("🚀 Buscando categorias para mapear nomes...")
     categorias = get_categories()
 
     print("🚀 Buscando estágios para todas as categorias...")
-    estagios_por_categoria = {}
-    for cat_id in categorias.keys():
-        estagios_por_categoria[cat_id] = get_stages(cat_id)
+    estagios_por_categoria, falhas = get_stages_em_lote(list(categorias.keys()))
+    for cat_id in falhas:
+        print(f"🚫 Falha ao obter estágios para categoria {cat_id}")
+    return categorias, estagios_por_categoria, operadora_map
+
+
+def traduzir_deal(deal, categorias, estagios_por_categoria, operadora_map):
+    cat_id = deal.get("CATEGORY_ID")
+    stage_id = deal.get("STAGE_ID")
+
+    # Substitui categoria e estágio por nome
+    if cat_id in categorias:
+        deal["CATEGORY_ID"] = categorias[cat_id]
+    if cat_id in estagios_por_categoria and stage_id in estagios_por_categoria[cat_id]:
+        deal["STAGE_ID"] = estagios_por_categoria[cat_id][stage_id]
+
+    # ✅ Converte IDs de operadoras para nomes
+    ids = deal.get("UF_CRM_1699452141037", [])
+    if not isinstance(ids, list):
+        ids = []
+    nomes = [operadora_map.get(str(i)) for i in ids if str(i) in operadora_map]
+    nomes_filtrados = [n for n in nomes if isinstance(n, str) and n.strip()]
+    deal["UF_CRM_1699452141037"] = ", ".join(nomes_filtrados) if nomes_filtrados else ""
+
+    # ✅ Formata a data de criação
+    deal["DATE_CREATE"] = format_date(deal.get("DATE_CREATE"))
+    deal["UF_CRM_1698761151613"] = format_date(deal.get("UF_CRM_1698761151613"))
+    return deal
+
+
+def buscar_pagina(params, start):
+    params = {**params, "start": start}
+    webhooks = webhooks_rotacionados(WEBHOOKS, start // TAMANHO_PAGINA)
+    for tentativa in range(1, MAX_RETRIES + 1):
+        print(f"📡 Requisição start={start}")
+        data = fazer_requisicao(webhooks, params)
+        if data is not None:
+            return data
+        espera = backoff_com_jitter(tentativa)
+        print(f"⏳ Retentativa {tentativa}/{MAX_RETRIES} (start={start}) em {espera:.1f}s...")
+        time.sleep(espera)
+    print(f"🚫 Máximo de tentativas para start={start}. Abortando.")
+    return None
+
+
+def buscar_lote(params, starts):
+    # Até PAGINAS_POR_BATCH páginas de crm.deal.list numa única chamada batch.
+    comandos = {
+        f"p{start}": ("crm.deal.list", {**params, "start": start}) for start in starts
+    }
+    indice = starts[0] // (TAMANHO_PAGINA * PAGINAS_POR_BATCH)
+    print(f"📡 Batch start={starts[0]}..{starts[-1]} ({len(starts)} páginas)")
+    with sync_etapa.cronometrar("busca"):
+        resultados, erros = executar_batch(
+            comandos, webhooks_rotacionados(BITRIX_BASES, indice), tentativas=MAX_RETRIES
+        )
+    if erros:
+        print(f"🚫 Batch start={starts[0]} com {len(erros)} páginas falhando. Abortando.")
+        return None
+    return [resultados[f"p{start}"] for start in starts]
+
+
+def buscar_paginas(params, starts, workers=SYNC_WORKERS, janela=SYNC_JANELA):
+    # Busca os lotes em paralelo, mas entrega as páginas na ordem dos offsets.
+    # A fila de futuros tem no máximo ``janela`` lotes, então a busca nunca se
+    # adianta mais que isso em relação à gravação.
+    lotes = (
+        starts[i : i + PAGINAS_POR_BATCH]
+        for i in range(0, len(starts), PAGINAS_POR_BATCH)
+    )
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pendentes = deque()
+        for lote in lotes:
+            pendentes.append(executor.submit(buscar_lote, params, lote))
+            if len(pendentes) >= janela:
+                break
+        while pendentes:
+            paginas = pendentes.popleft().result()
+            if paginas is None:
+                for futuro in pendentes:
+                    futuro.cancel()
+                yield None
+                return
+            proximo = next(lotes, None)
+            if proximo is not None:
+                pendentes.append(executor.submit(buscar_lote, params, proximo))
+            yield from paginas
+
 
+def buscar_todas_paginas(params):
+    primeira = buscar_pagina(params, 0)
+    if primeira is None:
+        yield None
+        return
+    # Com o total da primeira resposta os offsets seguintes são conhecidos.
+    total = int(primeira.get("total") or 0)
+    print(f"📊 Total a sincronizar: {total} | Workers: {SYNC_WORKERS}")
+    yield primeira
+    yield from buscar_paginas(params, range(TAMANHO_PAGINA, total, TAMANHO_PAGINA))
+
+
+def buscar_paginas_por_id(params):
+    # Keyset por ID, sequencial. No incremental um deal pode entrar no filtro
+    # DATE_MODIFY no meio do walk; com offsets isso desloca as páginas seguintes
+    # e pula deals já filtrados. Com filter[>ID] nada é pulado, e quem mudou
+    # depois do início tem DATE_MODIFY >= marca_atual e fica para o próximo.
+    ultimo_id = params.get("filter[>ID]")
     while True:
+        pagina_params = dict(params)
+        if ultimo_id is not None:
+            pagina_params["filter[>ID]"] = ultimo_id
+        data = buscar_pagina(pagina_params, -1)
+        if data is None:
+            yield None
+            return
+        deals = data.get("result") or []
+        yield data
+        if len(deals) < TAMANHO_PAGINA:
+            return
+        ultimo_id = max(int(deal["ID"]) for deal in deals)
+
+
+def traduzir_paginas(paginas, categorias, estagios_por_categoria, operadora_map):
+    for data in paginas:
+        if data is None:
+            yield None
+            return
+        with sync_etapa.cronometrar("traducao"):
+            deals = [
+                traduzir_deal(deal, categorias, estagios_por_categoria, operadora_map)
+                for deal in data.get("result", [])
+            ]
+        yield deals
+
+
+def gravar_paginas(conn, paginas, checkpoint=None, snapshot=False):
+    total = total_alterados = total_inalterados = 0
+    for deals in paginas:
+        if deals is None:
+            yield None
+            return
+        # ⬇️ Grava a página inteira no banco
+        with sync_etapa.cronometrar("gravacao"):
+            alterados, inalterados = upsert_deals(conn, deals)
+            if alterados:
+                # Página sem mudança não derruba o cache de resultados da API.
+                incrementar_versao_dados(conn)
+            conn.commit()
+        if snapshot:
+            # Toda página, mesmo sem alteração pelo hash: pode ser a reprise de
+            # uma que chegou ao Postgres mas não ao snapshot antes de o sync cair.
+            try:
+                if aplicar_no_snapshot(lambda: nullcontext(conn), [d["ID"] for d in deals]):
+                    # A API pode ter lido o snapshot antigo nesse meio tempo.
+                    incrementar_versao_dados(conn)
+            except Exception as e:
+                conn.rollback()
+                print(f"❌ Erro ao aplicar a página no snapshot, removendo-o: {e}")
+                invalidar_snapshot()
+                incrementar_versao_dados(conn)
+                snapshot = False
+        if checkpoint is not None:
+            # Só depois do Postgres e do snapshot: o checkpoint nunca passa à
+            # frente do que foi gravado.
+            if deals:
+                checkpoint["ultimo_id"] = max(int(d["ID"]) for d in deals)
+            checkpoint["deals"] += len(deals)
+            gravar_estado(conn, CHAVE_CHECKPOINT, json.dumps(checkpoint))
+        conn.commit()
+        sync_deals.incrementar("alterado", valor=alterados)
+        sync_deals.incrementar("inalterado", valor=inalterados)
+        total += len(deals)
+        total_alterados += alterados
+        total_inalterados += inalterados
         print(
-            f"📡 Requisição start={local_params['start']} | Total acumulado: {len(todos)}"
+            f"💾 Processados {len(deals)} registros ({alterados} alterados, "
+            f"{inalterados} inalterados). Total acumulado: {total}"
         )
-        data = fazer_requisicao(WEBHOOKS, local_params)
-        if data is None:
-            tentativas += 1
-            if tentativas >= MAX_RETRIES:
-                print("🚫 Máximo de tentativas. Abortando.")
-                break
-            print(f"⏳ Retentativa {tentativas}/{MAX_RETRIES} em {RETRY_DELAY}s...")
-            time.sleep(RETRY_DELAY)
-            continue
+        yield deals
+    print(f"📊 {total_alterados} deals alterados, {total_inalterados} inalterados.")
+
+
+def buscar_deals_por_id(ids):
+    # filter[ID][] vira array no PHP do Bitrix: até 50 IDs por crm.deal.list,
+    # e até 50 desses por batch. Mesma janela DATE_CREATE do sync.
+    comandos = {
+        f"d{i}": (
+            "crm.deal.list",
+            {
+                "select[]": PARAMS["select[]"],
+                "filter[>=DATE_CREATE]": PARAMS["filter[>=DATE_CREATE]"],
+                "filter[ID][]": ids[i : i + TAMANHO_PAGINA],
+                "start": -1,
+            },
+        )
+        for i in range(0, len(ids), TAMANHO_PAGINA)
+    }
+    resultados, erros = executar_batch(comandos)
+    if erros:
+        return None
+    return [deal for resultado in resultados.values() for deal in resultado["result"] or []]
 
-        tentativas = 0
-        deals = data.get("result", [])
-
-        # Substituir IDs por nomes antes de salvar:
-        for deal in deals:
-            cat_id = deal.get("CATEGORY_ID")
-            stage_id = deal.get("STAGE_ID")
-        
-            # Substitui categoria e estágio por nome
-            if cat_id in categorias:
-                deal["CATEGORY_ID"] = categorias[cat_id]
-            if cat_id in estagios_por_categoria and stage_id in estagios_por_categoria[cat_id]:
-                deal["STAGE_ID"] = estagios_por_categoria[cat_id][stage_id]
-        
-            # ✅ Converte IDs de operadoras para nomes
-            ids = deal.get("UF_CRM_1699452141037", [])
-            if not isinstance(ids, list):
-                ids = []
-            nomes = [operadora_map.get(str(i)) for i in ids if str(i) in operadora_map]
-            nomes_filtrados = [n for n in nomes if isinstance(n, str) and n.strip()]
-            deal["UF_CRM_1699452141037"] = ", ".join(nomes_filtrados) if nomes_filtrados else ""
-        
-            # ✅ Formata a data de criação
-            deal["DATE_CREATE"] = format_date(deal.get("DATE_CREATE"))
-            deal["UF_CRM_1698761151613"] = format_date(deal.get("UF_CRM_1698761151613"))
-
-
-        
-            # ⬇️ Grava no banco
-            upsert_deal(conn, deal)
-
-
-
-
-        todos.extend(deals)
+
+def sincronizar_deals(conectar, ids, apagados=(), metadados=None):
+    """Atualiza só os deals ``ids`` e remove os ``apagados``.
+
+    Usado pelos eventos do Bitrix: mesma busca, tradução e upsert do sync. IDs
+    que o Bitrix não devolve (fora da janela ou já apagados) são ignorados;
+    só um ONCRMDEALDELETE remove a linha. ``conectar()`` devolve um context
+    manager com a conexão do Postgres, pedida só depois da busca no Bitrix.
+    Se houver snapshot, as mesmas linhas são aplicadas nele; se a aplicação
+    falhar, o snapshot é removido e a API passa a ler do Postgres.
+    """
+    ids = list(ids)
+    deals = buscar_deals_por_id(ids) if ids else []
+    if deals is None:
+        raise RuntimeError(f"falha ao buscar {len(ids)} deals no Bitrix")
+    categorias, estagios_por_categoria, operadora_map = metadados or carregar_metadados()
+    deals = [
+        traduzir_deal(deal, categorias, estagios_por_categoria, operadora_map)
+        for deal in deals
+    ]
+    with conectar() as conn:
+        alterados, inalterados = upsert_deals(conn, deals)
+        removidos = 0
+        if apagados:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM bitrix WHERE id IN %s;", (tuple(apagados),))
+                removidos = cur.rowcount
+        if alterados or removidos:
+            incrementar_versao_dados(conn)
         conn.commit()
-        print(f"💾 Processados {len(deals)} registros.")
+    # Sempre, mesmo sem alteração pelo hash: numa reprise da fila o Postgres
+    # já está em dia, mas o snapshot pode não estar.
+    try:
+        aplicados = aplicar_no_snapshot(conectar, ids + list(apagados))
+    except Exception as e:
+        print(f"❌ Erro ao aplicar os deals no snapshot, removendo-o: {e}")
+        invalidar_snapshot()
+        aplicados = 0
+    if aplicados is not None:
+        # A API pode ter lido o snapshot antigo entre os dois commits.
+        with conectar() as conn:
+            incrementar_versao_dados(conn)
+            conn.commit()
+    return {
+        "alterados": alterados,
+        "inalterados": inalterados,
+        "removidos": removidos,
+        "ausentes": len(ids) - len(deals),
+    }
 
-        if "next" in data and data["next"]:
-            local_params["start"] = data["next"]
-            time.sleep(
-                PAGE_DELAY if len(todos) >= LIMITE_REGISTROS_TURBO else REQUEST_DELAY
+
+def ler_checkpoint(conn):
+    valor = ler_estado(conn, CHAVE_CHECKPOINT)
+    return json.loads(valor) if valor else None
+
+
+def novo_checkpoint(conn, completo):
+    marca_anterior = None if completo else ler_estado(conn, CHAVE_MARCA_DATE_MODIFY)
+    filtros = {"filter[>=DATE_CREATE]": PARAMS["filter[>=DATE_CREATE]"]}
+    if marca_anterior:
+        filtros["filter[>=DATE_MODIFY]"] = marca_anterior
+    return {
+        "run_id": uuid.uuid4().hex,
+        "completo": not marca_anterior,
+        "filtros": filtros,
+        "marca_atual": obter_marca_atual(),
+        "ultimo_id": None,
+        "deals": 0,
+        "iniciado_em": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def iterar_deals(completo=False, reiniciar=False):
+    """Sincroniza o Bitrix e devolve os deals traduzidos à medida que são gravados.
+
+    Busca → tradução → gravação são geradores encadeados; só a janela de busca
+    fica em memória, independente do número de deals.
+
+    Cada página gravada atualiza um checkpoint em sync_estado (run, janela de
+    filtros, último ID). Se o sync anterior parou no meio, este retoma com
+    ``filter[>ID]`` a partir dali, com a mesma janela e a mesma marca
+    DATE_MODIFY final. ``reiniciar`` descarta o checkpoint; um ``completo``
+    também descarta o de um incremental.
+    """
+    conn = get_conn()
+    try:
+        conn.autocommit = False
+        garantir_schema(conn)
+        limitador.reiniciar()
+
+        checkpoint = None if reiniciar else ler_checkpoint(conn)
+        if checkpoint and completo and not checkpoint["completo"]:
+            checkpoint = None
+        if checkpoint:
+            print(
+                f"⏯️ Retomando sync {checkpoint['run_id'][:8]} após o ID "
+                f"{checkpoint['ultimo_id']} ({checkpoint['deals']} deals já gravados)"
             )
         else:
-            print("🏁 Fim da paginação.")
-            break
+            checkpoint = novo_checkpoint(conn, completo)
+            gravar_estado(conn, CHAVE_CHECKPOINT, json.dumps(checkpoint))
+            conn.commit()
+
+        local_params = {**PARAMS, **checkpoint["filtros"]}
+        if checkpoint["ultimo_id"] is not None:
+            local_params["filter[>ID]"] = checkpoint["ultimo_id"]
+        marca_atual = checkpoint["marca_atual"]
+        if "filter[>=DATE_MODIFY]" in local_params:
+            print(f"🔁 Sync incremental: DATE_MODIFY >= {local_params['filter[>=DATE_MODIFY]']}")
+        else:
+            print("🔁 Sync completo desde DATE_CREATE >= " + local_params["filter[>=DATE_CREATE]"])
+
+        categorias, estagios_por_categoria, operadora_map = carregar_metadados()
+
+        if "filter[>=DATE_MODIFY]" in local_params:
+            paginas = buscar_paginas_por_id(local_params)
+        else:
+            paginas = buscar_todas_paginas(local_params)
+        traduzidas = traduzir_paginas(
+            paginas, categorias, estagios_por_categoria, operadora_map
+        )
+        # O completo republica o snapshot inteiro no fim; o incremental só
+        # aplica as páginas alteradas no snapshot que já existe.
+        aplicar_snapshot = (
+            SNAPSHOT_PUBLICAR and not checkpoint["completo"] and snapshot_atual()
+        )
+        for deals in gravar_paginas(conn, traduzidas, checkpoint, aplicar_snapshot):
+            if deals is None:
+                print(
+                    "🚫 Sync interrompido; a marca DATE_MODIFY não foi avançada. "
+                    "A próxima execução retoma do checkpoint."
+                )
+                return
+            yield from deals
+
+        print("🏁 Fim da paginação.")
+        print(f"⚙️ Limitador: {limitador.info()}")
+        if marca_atual:
+            gravar_estado(conn, CHAVE_MARCA_DATE_MODIFY, marca_atual)
+            print(f"📌 Marca DATE_MODIFY atualizada para {marca_atual}")
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM sync_estado WHERE chave = %s;", (CHAVE_CHECKPOINT,))
+        conn.commit()
+
+        # Publica inteiro também se o snapshot foi removido por uma falha.
+        if SNAPSHOT_PUBLICAR and not (aplicar_snapshot and snapshot_atual()):
+            try:
+                publicar_snapshot(conn)
+                # A API pode estar lendo do snapshot: invalida o cache de novo.
+                incrementar_versao_dados(conn)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"❌ Erro ao publicar snapshot: {e}")
+    finally:
+        conn.close()
+        if METRICAS_ARQUIVO:
+            registro.gravar(METRICAS_ARQUIVO)
+
+
+def baixar_todos_dados(completo=False, reiniciar=False):
+    total = 0
+    for _ in iterar_deals(completo=completo, reiniciar=reiniciar):
+        total += 1
+    return total
+
+
+if __name__ == "__main__":
+    import argparse
 
-    conn.close()
-    return todos
+    arg_parser = argparse.ArgumentParser(description="Sincroniza deals do Bitrix.")
+    arg_parser.add_argument(
+        "--completo",
+        action="store_true",
+        help="Ignora a marca DATE_MODIFY e refaz o histórico inteiro.",
+    )
+    arg_parser.add_argument(
+        "--reiniciar",
+        action="store_true",
+        help="Descarta o checkpoint de um sync interrompido e começa do zero.",
+    )
+    args = arg_parser.parse_args()
+    baixar_todos_dados(completo=args.completo, reiniciar=args.reiniciar)
@@ -0,0 +1,99 @@
+"""Compara a formatação antiga (dict montado célula a célula + json) com a nova.
+
+Não acessa banco nem Bitrix: gera linhas sintéticas no formato de
+SQL_CAMPOS_CEP e troca os metadados de categorias/estágios por dicts fixos.
+
+    python benchmarks/bench_formatacao.py --linhas 50000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+
+import main
+from main import COLUNAS_CEP, FORMATO_CEP, formatar_dado, montar_resultado
+
+CATEGORIAS = {str(i): f"Categoria {i}" for i in range(10)}
+STAGES = {f"C{i}:NEW": f"Fase {i}" for i in range(10)}
+
+
+def linha_sintetica(i):
+    valores = [f" valor {i} {c} " for c in COLUNAS_CEP]
+    valores[0] = i
+    valores[2] = f"C{i % 10}:NEW"
+    valores[3] = str(i % 10)
+    valores[4] = f"{i % 99999999:08d}"
+    return tuple(valores)
+
+
+def formatar_antigo(rows):
+    # Cópia do montar_resultado anterior: formatar_dado em cada célula e
+    # consulta aos metadados a cada linha.
+    resultados = []
+    for r in rows:
+        cat_id = r[3]
+        resultado = {
+            chave: formatar_dado(r[i]) for i, chave in enumerate(COLUNAS_CEP)
+        }
+        resultado["id"] = r[0]
+        resultado["fase"] = formatar_dado(main.get_stages(cat_id).get(r[2], r[2]))
+        resultado["categoria"] = formatar_dado(
+            main.get_categories().get(cat_id, str(cat_id))
+        )
+        resultados.append(resultado)
+    return resultados
+
+
+def medir(funcao, rows, repeticoes):
+    melhor = float("inf")
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(rows)
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return len(rows) / melhor
+
+
+def caminho_antigo(rows):
+    corpo = {"total": len(rows), "resultados": formatar_antigo(rows)}
+    return json.dumps(jsonable_encoder(corpo), ensure_ascii=False).encode("utf-8")
+
+
+def caminho_novo(rows):
+    resultados = montar_resultado(rows, FORMATO_CEP)
+    return main.RespostaJSON({"total": len(rows), "resultados": resultados}).body
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--linhas", type=int, default=50000)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    main.get_categories = lambda: CATEGORIAS
+    main.get_stages = lambda category_id: STAGES
+
+    # SQL_CAMPOS_CEP entrega os textos já aparados.
+    rows = [
+        tuple(v.strip() if isinstance(v, str) else v for v in linha_sintetica(i))
+        for i in range(args.linhas)
+    ]
+    resultado = {
+        "linhas": args.linhas,
+        "antigo_rows_s": medir(caminho_antigo, rows, args.repeticoes),
+        "novo_rows_s": medir(caminho_novo, rows, args.repeticoes),
+    }
+    resultado["ganho"] = resultado["novo_rows_s"] / resultado["antigo_rows_s"]
+
+    if args.json:
+        print(json.dumps(resultado))
+    else:
+        print(f"antigo : {resultado['antigo_rows_s']:.0f} rows/s")
+        print(f"novo   : {resultado['novo_rows_s']:.0f} rows/s")
+        print(f"ganho  : {resultado['ganho']:.1f}x")
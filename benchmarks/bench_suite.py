@@ -0,0 +1,316 @@
+"""Suíte de benchmark: sync contra um Bitrix falso e latência dos endpoints.
+
+Sobe benchmarks/fake_bitrix.py, recria as tabelas ``bitrix``, ``sync_estado``
+e ``geral`` num Postgres local descartável, mede o ``baixar_todos_dados`` em
+rows/s e depois dispara cada endpoint do main.py com N clientes simultâneos,
+medindo p50/p99. O resultado sai em JSON para acompanhar regressões.
+
+    python benchmarks/bench_suite.py --db-nome bench --deals 20000 \\
+        --concorrencia 8 --requisicoes 400 --saida bench.json
+
+ATENÇÃO: as tabelas do banco indicado são apagadas. Use um banco só para isso.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import psycopg2
+import requests
+from psycopg2.extras import execute_values
+
+from fake_bitrix import CIDADES, BitrixFalso, ServidorBitrixFalso, cep_sintetico
+from fake_eventos import corpo_evento, sortear_evento
+
+TOKEN_EVENTOS = "bench"
+
+COLUNAS_BITRIX_BENCH = [
+    "id", "title", "stage_id", "category_id", "uf_crm_cep", "uf_crm_contato",
+    "date_create", "contato01", "contato02", "ordem_de_servico", "nome_do_cliente",
+    "nome_da_mae", "data_de_vencimento", "email", "cpf", "rg", "referencia", "rua",
+    "data_de_instalacao", "quais_operadoras_tem_viabilidade", "uf_crm_bairro",
+    "uf_crm_cidade", "uf_crm_numero", "uf_crm_uf",
+    # Só para que "base" fique na posição 27 do SELECT *, como em produção;
+    # cep_normalizado é acrescentada pelo garantir_schema do sync.
+    "opportunity", "begindate", "source_id", "base",
+]
+
+COLUNAS_GERAL = [
+    "cpf", "nome", "telefone", "rua", "numero", "bairro", "cep", "cidade",
+    "estado", "email", "base",
+]
+
+
+def configurar_ambiente(args, portal, pasta):
+    banco = {
+        "NAME": args.db_nome,
+        "USER": args.db_usuario,
+        "PASSWORD": args.db_senha,
+        "HOST": args.db_host,
+        "PORT": str(args.db_porta),
+    }
+    for chave, valor in banco.items():
+        os.environ[f"DB_{chave}"] = valor
+        os.environ[f"DB_{chave}_MATEUS"] = valor
+    os.environ.update(
+        {
+            "BITRIX_PORTAL": portal,
+            "BITRIX_TOKENS": "token1,token2",
+            "BITRIX_API_BASE": f"{portal}/token1",
+            "BITRIX_RPS_INICIAL": str(args.rps),
+            "BITRIX_RPS_MAX": str(args.rps),
+            "BITRIX_BACKOFF_MAX": "2",
+            "SNAPSHOT_PATH": os.path.join(pasta, "bitrix.sqlite"),
+            "SNAPSHOT_PUBLICAR": "1" if args.leitura == "snapshot" else "0",
+            "USAR_SNAPSHOT": "1" if args.leitura == "snapshot" else "0",
+            "BITRIX_EVENTOS_TOKEN": TOKEN_EVENTOS,
+            "IMPORTACOES_DIR": os.path.join(pasta, "importacoes"),
+        }
+    )
+    if not args.cache:
+        os.environ["RESULTADO_CACHE_BYTES"] = "0"
+
+
+def preparar_banco(params, linhas_geral, indices):
+    conn = psycopg2.connect(**params)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DROP TABLE IF EXISTS bitrix, sync_estado, geral;")
+            colunas = ", ".join(
+                "id BIGINT PRIMARY KEY" if c == "id" else f"{c} TEXT"
+                for c in COLUNAS_BITRIX_BENCH
+            )
+            cur.execute(f"CREATE TABLE bitrix ({colunas});")
+            cur.execute(
+                f"CREATE TABLE geral ({', '.join(f'{c} TEXT' for c in COLUNAS_GERAL)});"
+            )
+            execute_values(
+                cur,
+                f"INSERT INTO geral ({', '.join(COLUNAS_GERAL)}) VALUES %s",
+                [linha_geral(i) for i in range(linhas_geral)],
+                page_size=1000,
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    if indices:
+        import indices_busca
+
+        for fonte, cfg in indices_busca.INDICES.items():
+            indices_busca.criar_indices(fonte, {**cfg, "params": params})
+
+
+def linha_geral(i):
+    cidade, uf = CIDADES[i % len(CIDADES)]
+    return (
+        f"{i:011d}", f"CLIENTE GERAL {i}", f"11 8{i:08d}", f"RUA {i % 997} DE {cidade.split()[0]}",
+        str(1 + i % 900), f"BAIRRO {i % 113}", cep_sintetico(i, 5000), cidade, uf,
+        f"geral{i}@exemplo.com", "GERAL",
+    )
+
+
+def medir_sync():
+    import atualizar_cache
+
+    inicio = time.perf_counter()
+    total = atualizar_cache.baixar_todos_dados(completo=True)
+    duracao = time.perf_counter() - inicio
+    return {
+        "deals": total,
+        "segundos": duracao,
+        "rows_s": total / duracao if duracao else 0.0,
+        "limitador": atualizar_cache.limitador.info(),
+    }
+
+
+def subir_api(porta):
+    import uvicorn
+
+    import main
+
+    servidor = uvicorn.Server(
+        uvicorn.Config(main.app, host="127.0.0.1", port=porta, log_level="warning")
+    )
+    thread = threading.Thread(target=servidor.run, daemon=True)
+    thread.start()
+    while not servidor.started:
+        time.sleep(0.05)
+    return servidor, thread
+
+
+def percentil(ordenados, q):
+    if not ordenados:
+        return None
+    return ordenados[min(len(ordenados) - 1, int(round(q * (len(ordenados) - 1))))]
+
+
+def medir_endpoint(fazer, concorrencia, requisicoes):
+    local = threading.local()
+
+    def uma(_):
+        sessao = getattr(local, "sessao", None)
+        if sessao is None:
+            sessao = local.sessao = requests.Session()
+        inicio = time.perf_counter()
+        try:
+            resp = fazer(sessao)
+            ok = resp.status_code < 400
+            resp.content
+        except requests.RequestException:
+            ok = False
+        return (time.perf_counter() - inicio) * 1000, ok
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        medidas = list(executor.map(uma, range(requisicoes)))
+    duracao = time.perf_counter() - inicio
+
+    latencias = sorted(ms for ms, _ in medidas)
+    return {
+        "requisicoes": requisicoes,
+        "erros": sum(1 for _, ok in medidas if not ok),
+        "req_s": requisicoes / duracao,
+        "p50_ms": percentil(latencias, 0.50),
+        "p99_ms": percentil(latencias, 0.99),
+        "max_ms": latencias[-1] if latencias else None,
+    }
+
+
+def endpoints(base, ceps_arquivo, deals):
+    cep = cep_sintetico(7, 5000)
+    sorteio = random.Random(1)
+    arquivo = "cep\n" + "\n".join(ceps_arquivo) + "\n"
+
+    def upload(sessao, formato):
+        return sessao.post(
+            f"{base}/buscar",
+            files={"arquivo": ("ceps.csv", io.BytesIO(arquivo.encode()))},
+            data={"formato": formato},
+        )
+
+    def progresso(sessao):
+        resp = upload(sessao, "txt")
+        return sessao.get(f"{base}/buscar/progresso/{resp.headers['X-Importacao-Id']}")
+
+    def evento(sessao):
+        # Sem ONCRMDEALDELETE: os deals continuam lá para as outras medições.
+        nome, deal_id = sortear_evento(sorteio, deals, taxa_delete=0.0, taxa_add=0.1)
+        return sessao.post(
+            f"{base}/bitrix/eventos", data=corpo_evento(nome, deal_id, TOKEN_EVENTOS)
+        )
+
+    return {
+        "GET /": lambda s: s.get(f"{base}/"),
+        "GET /buscar-cep": lambda s: s.get(f"{base}/buscar-cep", params={"cep": cep}),
+        "GET /buscar-rua": lambda s: s.get(f"{base}/buscar-rua", params={"rua": "RUA 12 "}),
+        "GET /buscar-bairro": lambda s: s.get(
+            f"{base}/buscar-bairro", params={"bairro": "BAIRRO 4"}
+        ),
+        "GET /buscar-cidade": lambda s: s.get(
+            f"{base}/buscar-cidade", params={"cidade": "CURITIBA"}
+        ),
+        "GET /buscar-estado": lambda s: s.get(
+            f"{base}/buscar-estado", params={"estado": "BA"}
+        ),
+        "GET /search/{param}/{value}": lambda s: s.get(f"{base}/search/rua/RUA 33 "),
+        "POST /search-amount/{param}": lambda s: s.post(
+            f"{base}/search-amount/bairro",
+            json={"values": [f"BAIRRO {i}" for i in range(100, 110)]},
+        ),
+        "GET /ceps/faixa": lambda s: s.get(f"{base}/ceps/faixa", params={"prefixo": "010"}),
+        "GET /stats": lambda s: s.get(f"{base}/stats"),
+        "GET /metrics": lambda s: s.get(f"{base}/metrics"),
+        "POST /buscar (cep)": lambda s: s.post(f"{base}/buscar", data={"cep": cep}),
+        "POST /buscar (arquivo txt)": lambda s: upload(s, "txt"),
+        "POST /buscar (arquivo xlsx)": lambda s: upload(s, "xlsx"),
+        "GET /buscar/progresso/{id}": progresso,
+        # Por último: a fila segue gravando no Postgres depois da medição.
+        "POST /bitrix/eventos": evento,
+    }
+
+
+def commit_atual():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=RAIZ, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-nome", required=True, help="Banco descartável (será apagado).")
+    parser.add_argument("--db-usuario", default=os.getenv("USER", "postgres"))
+    parser.add_argument("--db-senha", default="")
+    parser.add_argument("--db-host", default="127.0.0.1")
+    parser.add_argument("--db-porta", type=int, default=5432)
+    parser.add_argument("--deals", type=int, default=20000)
+    parser.add_argument("--linhas-geral", type=int, default=20000)
+    parser.add_argument("--latencia-ms", type=float, default=20)
+    parser.add_argument("--taxa-429", type=float, default=0.0)
+    parser.add_argument("--rps", type=float, default=50, help="Taxa do limitador no sync.")
+    parser.add_argument("--concorrencia", type=int, default=8)
+    parser.add_argument("--requisicoes", type=int, default=200)
+    parser.add_argument("--leitura", choices=["snapshot", "postgres"], default="snapshot")
+    parser.add_argument("--cache", action="store_true", help="Liga o cache de resultados.")
+    parser.add_argument("--indices", action="store_true", help="Cria os índices trigram.")
+    parser.add_argument("--endpoint", action="append", help="Mede só estes endpoints.")
+    parser.add_argument("--porta-api", type=int, default=18080)
+    parser.add_argument("--saida", help="Arquivo JSON com o resultado.")
+    args = parser.parse_args()
+
+    bitrix = BitrixFalso(args.deals, latencia_ms=args.latencia_ms, taxa_429=args.taxa_429)
+    servidor_bitrix = ServidorBitrixFalso(bitrix).iniciar()
+    pasta = tempfile.mkdtemp(prefix="bench_cep_")
+    configurar_ambiente(args, servidor_bitrix.portal, pasta)
+    os.chdir(RAIZ)
+
+    from atualizar_cache import DB_PARAMS
+
+    preparar_banco(DB_PARAMS, args.linhas_geral, args.indices)
+    resultado = {
+        "quando": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit_atual(),
+        "python": platform.python_version(),
+        "parametros": {k: v for k, v in vars(args).items() if k != "db_senha"},
+        "sync": medir_sync(),
+    }
+    resultado["bitrix_falso"] = dict(bitrix.stats)
+
+    servidor_api, _ = subir_api(args.porta_api)
+    try:
+        base = f"http://127.0.0.1:{args.porta_api}"
+        ceps = [cep_sintetico(i, 5000) for i in range(0, 2000, 10)]
+        resultado["endpoints"] = {}
+        for nome, fazer in endpoints(base, ceps, args.deals).items():
+            if args.endpoint and nome not in args.endpoint:
+                continue
+            print(f"⏱️ {nome}...", file=sys.stderr)
+            resultado["endpoints"][nome] = medir_endpoint(
+                fazer, args.concorrencia, args.requisicoes
+            )
+    finally:
+        servidor_api.should_exit = True
+        servidor_bitrix.parar()
+
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto)
+    print(texto)
@@ -0,0 +1,116 @@
+"""Compara upsert_deal (linha a linha) com upsert_deals (lote) em rows/sec.
+
+Mede também a regravação da mesma base com só ``--alterados`` dos deals
+mudados: o hash de conteúdo faz o resto passar sem reescrever a linha.
+
+Roda contra o banco de DB_PARAMS, mas grava numa tabela TEMP ``bitrix`` que
+sombreia a real durante a sessão, então não toca nos dados de produção.
+
+    python benchmarks/bench_upsert.py --linhas 20000 --pagina 50
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from atualizar_cache import COLUNAS_BITRIX, get_conn, upsert_deal, upsert_deals
+
+
+def deal_sintetico(i):
+    return {
+        "ID": str(i),
+        "TITLE": f"Deal {i}",
+        "STAGE_ID": "NEW",
+        "CATEGORY_ID": "0",
+        "UF_CRM_1700661314351": f"{random.randint(1000000, 99999999):08d}",
+        "CONTACT_ID": str(i),
+        "DATE_CREATE": "01/01/2024",
+        "UF_CRM_1698688252221": f"Rua {i % 997}",
+        "UF_CRM_1700661287551": f"Bairro {i % 113}",
+        "UF_CRM_1731588487": "SAO PAULO",
+        "UF_CRM_1731589190": "SP",
+    }
+
+
+def criar_tabela_temp(conn):
+    colunas = ", ".join(
+        "id BIGINT PRIMARY KEY" if c == "id" else f"{c} TEXT" for c in COLUNAS_BITRIX
+    )
+    with conn.cursor() as cur:
+        cur.execute("DROP TABLE IF EXISTS pg_temp.bitrix;")
+        cur.execute(f"CREATE TEMP TABLE bitrix ({colunas});")
+    conn.commit()
+
+
+def medir(conn, deals, pagina, por_linha):
+    criar_tabela_temp(conn)
+    inicio = time.perf_counter()
+    for i in range(0, len(deals), pagina):
+        lote = deals[i : i + pagina]
+        if por_linha:
+            for deal in lote:
+                upsert_deal(conn, deal)
+        else:
+            upsert_deals(conn, lote)
+        conn.commit()
+    return len(deals) / (time.perf_counter() - inicio)
+
+
+def medir_regravacao(conn, deals, pagina, fracao):
+    # Roda depois de medir(): a tabela já tem todos os deals.
+    mudados = set(random.Random(1).sample(range(len(deals)), int(len(deals) * fracao)))
+    deals = [
+        {**deal, "TITLE": deal["TITLE"] + " (editado)"} if i in mudados else deal
+        for i, deal in enumerate(deals)
+    ]
+    alterados = inalterados = 0
+    inicio = time.perf_counter()
+    for i in range(0, len(deals), pagina):
+        a, n = upsert_deals(conn, deals[i : i + pagina])
+        alterados += a
+        inalterados += n
+        conn.commit()
+    return len(deals) / (time.perf_counter() - inicio), alterados, inalterados
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--linhas", type=int, default=20000)
+    parser.add_argument("--pagina", type=int, default=50)
+    parser.add_argument("--alterados", type=float, default=0.01)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    deals = [deal_sintetico(i) for i in range(args.linhas)]
+    conn = get_conn()
+    try:
+        resultado = {
+            "linhas": args.linhas,
+            "pagina": args.pagina,
+            "upsert_deal_rows_s": medir(conn, deals, args.pagina, True),
+            "upsert_deals_rows_s": medir(conn, deals, args.pagina, False),
+        }
+        taxa, alterados, inalterados = medir_regravacao(conn, deals, args.pagina, args.alterados)
+        resultado.update(
+            regravacao_rows_s=taxa, regravacao_alterados=alterados,
+            regravacao_inalterados=inalterados,
+        )
+    finally:
+        conn.close()
+    resultado["ganho"] = resultado["upsert_deals_rows_s"] / resultado["upsert_deal_rows_s"]
+
+    if args.json:
+        print(json.dumps(resultado))
+    else:
+        print(f"upsert_deal  : {resultado['upsert_deal_rows_s']:.0f} rows/s")
+        print(f"upsert_deals : {resultado['upsert_deals_rows_s']:.0f} rows/s")
+        print(f"ganho        : {resultado['ganho']:.1f}x")
+        print(
+            f"regravação   : {resultado['regravacao_rows_s']:.0f} rows/s "
+            f"({alterados} alterados, {inalterados} inalterados)"
+        )
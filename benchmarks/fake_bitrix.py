@@ -0,0 +1,282 @@
+"""Bitrix24 REST falso para benchmarks: deals sintéticos, latência e 429.
+
+Atende os métodos que o sync e a API usam (crm.deal.list, crm.deal.fields,
+crm.dealcategory.list, crm.dealcategory.stage.list, crm.category.list e
+batch) em ``/rest/<usuario>/<token>/<metodo>``, com qualquer token. O
+``select[]`` é ignorado: cada deal vem com todos os campos.
+
+    python benchmarks/fake_bitrix.py --deals 100000 --latencia-ms 80 --taxa-429 0.02
+    BITRIX_PORTAL=http://127.0.0.1:8765/rest/1 python atualizar_cache.py --completo
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+TAMANHO_PAGINA = 50
+
+CATEGORIAS = {str(i): f"Pipeline {i}" for i in range(5)}
+ESTAGIOS = ["NEW", "PREPARATION", "EXECUTING", "WON", "LOSE"]
+OPERADORAS = {str(100 + i): nome for i, nome in enumerate(["Vivo", "Claro", "Oi", "Tim"])}
+CIDADES = [
+    ("SAO PAULO", "SP"),
+    ("RIO DE JANEIRO", "RJ"),
+    ("BELO HORIZONTE", "MG"),
+    ("CURITIBA", "PR"),
+    ("SALVADOR", "BA"),
+    ("PORTO ALEGRE", "RS"),
+]
+INICIO = datetime(2022, 1, 1, 8, 0, 0)
+
+
+def cep_sintetico(i, distintos):
+    return f"{(i % distintos) * 97 + 1000000:08d}"
+
+
+def deal_sintetico(i, ceps_distintos=5000):
+    cidade, uf = CIDADES[i % len(CIDADES)]
+    cat_id = str(i % len(CATEGORIAS))
+    criado = INICIO + timedelta(minutes=17 * i)
+    cep = cep_sintetico(i, ceps_distintos)
+    return {
+        "ID": str(i + 1),
+        "TITLE": f"Deal {i + 1}",
+        "STAGE_ID": f"C{cat_id}:{ESTAGIOS[i % len(ESTAGIOS)]}",
+        "CATEGORY_ID": cat_id,
+        "OPPORTUNITY": f"{(i % 300) * 10}.00",
+        "CONTACT_ID": str(50000 + i),
+        "UF_CRM_1700661314351": f"{cep[:5]}-{cep[5:]}",
+        "UF_CRM_1698698407472": f"11 9{i % 100000000:08d}",
+        "UF_CRM_1698698858832": "",
+        "UF_CRM_1697653896576": f"OS-{i:07d}",
+        "UF_CRM_1697762313423": f"Cliente {i}",
+        "UF_CRM_1697763267151": f"Mae {i % 1000}",
+        "UF_CRM_1697764091406": str(1 + i % 28),
+        "UF_CRM_1697807340141": f"cliente{i}@exemplo.com",
+        "UF_CRM_1697807353336": f"{i % 100000000000:011d}",
+        "UF_CRM_1697807372536": f"{i % 1000000000:09d}",
+        "UF_CRM_1697808018193": "Proximo ao mercado",
+        "UF_CRM_1698688252221": f"RUA {i % 997} DE {cidade.split()[0]}",
+        "UF_CRM_1698761151613": (criado + timedelta(days=7)).isoformat() + "+03:00",
+        "UF_CRM_1699452141037": [k for j, k in enumerate(OPERADORAS) if (i >> j) & 1],
+        "UF_CRM_1700661287551": f"BAIRRO {i % 113}",
+        "UF_CRM_1731588487": cidade,
+        "UF_CRM_1700661252544": str(1 + i % 2000),
+        "UF_CRM_1731589190": uf,
+        "DATE_CREATE": criado.isoformat() + "+03:00",
+        "DATE_MODIFY": (criado + timedelta(hours=i % 48)).isoformat() + "+03:00",
+    }
+
+
+class BitrixFalso:
+    """Estado do portal falso: os deals e os contadores de chamadas."""
+
+    def __init__(self, deals, ceps_distintos=5000, latencia_ms=0, taxa_429=0.0, semente=1):
+        self.deals = [deal_sintetico(i, ceps_distintos) for i in range(deals)]
+        self.latencia = latencia_ms / 1000
+        self.taxa_429 = taxa_429
+        self._random = random.Random(semente)
+        self._lock = threading.Lock()
+        self.stats = {"requisicoes": 0, "throttles": 0, "comandos": 0}
+
+    def _sortear_429(self):
+        with self._lock:
+            self.stats["requisicoes"] += 1
+            if self._random.random() < self.taxa_429:
+                self.stats["throttles"] += 1
+                return True
+        return False
+
+    def deal_list(self, params):
+        deals = self.deals
+        desde = params.get("filter[>=DATE_MODIFY]")
+        if desde:
+            deals = [d for d in deals if d["DATE_MODIFY"] >= desde]
+        ids = params.get("filter[ID][]")
+        if ids:
+            ids = set(ids)
+            deals = [d for d in deals if d["ID"] in ids]
+        apos_id = params.get("filter[>ID]")
+        if apos_id:
+            deals = [d for d in deals if int(d["ID"]) > int(apos_id)]
+        start = int(params.get("start", 0))
+        if params.get("order[DATE_MODIFY]", "").upper() == "DESC":
+            deals = sorted(deals, key=lambda d: d["DATE_MODIFY"], reverse=True)
+        if start < 0:
+            # start=-1: o Bitrix não conta o total.
+            return {"result": deals[:TAMANHO_PAGINA]}
+        pagina = deals[start : start + TAMANHO_PAGINA]
+        resposta = {"result": pagina, "total": len(deals)}
+        if start + TAMANHO_PAGINA < len(deals):
+            resposta["next"] = start + TAMANHO_PAGINA
+        return resposta
+
+    def executar(self, metodo, params):
+        with self._lock:
+            self.stats["comandos"] += 1
+        if metodo == "crm.deal.list":
+            return self.deal_list(params)
+        if metodo == "crm.dealcategory.list":
+            return {
+                "result": [{"ID": k, "NAME": v} for k, v in CATEGORIAS.items()],
+                "total": len(CATEGORIAS),
+            }
+        if metodo == "crm.dealcategory.stage.list":
+            cat_id = str(params.get("id", "0"))
+            return {
+                "result": [
+                    {"STATUS_ID": f"C{cat_id}:{e}", "NAME": f"{e.title()} {cat_id}"}
+                    for e in ESTAGIOS
+                ],
+                "total": len(ESTAGIOS),
+            }
+        if metodo == "crm.category.list":
+            return {
+                "result": {
+                    "categories": [
+                        {"id": int(k), "name": v} for k, v in CATEGORIAS.items()
+                    ]
+                }
+            }
+        if metodo == "crm.deal.fields":
+            return {
+                "result": {
+                    "UF_CRM_1699452141037": {
+                        "items": [{"ID": k, "VALUE": v} for k, v in OPERADORAS.items()]
+                    }
+                }
+            }
+        return None
+
+    def batch(self, params):
+        resultado, erros, totais, proximos = {}, {}, {}, {}
+        for chave, comando in params.items():
+            if not (chave.startswith("cmd[") and chave.endswith("]")):
+                continue
+            chave = chave[4:-1]
+            metodo, _, query = comando.partition("?")
+            data = self.executar(metodo, _simplificar(parse_qs(query)))
+            if data is None:
+                erros[chave] = {"error": "ERROR_METHOD_NOT_FOUND"}
+                continue
+            resultado[chave] = data["result"]
+            if "total" in data:
+                totais[chave] = data["total"]
+            if "next" in data:
+                proximos[chave] = data["next"]
+        # Como o PHP do Bitrix: dicionários vazios viram [].
+        return {
+            "result": {
+                "result": resultado or [],
+                "result_error": erros or [],
+                "result_total": totais or [],
+                "result_next": proximos or [],
+                "result_time": [],
+            }
+        }
+
+
+def _simplificar(params):
+    return {k: v if k.endswith("[]") else v[-1] for k, v in params.items()}
+
+
+def criar_handler(bitrix):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _responder(self, status, corpo, headers=None):
+            dados = json.dumps(corpo).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(dados)))
+            for nome, valor in (headers or {}).items():
+                self.send_header(nome, valor)
+            self.end_headers()
+            self.wfile.write(dados)
+
+        def _tratar(self, params):
+            inicio = time.monotonic()
+            if bitrix.latencia:
+                time.sleep(bitrix.latencia)
+            if bitrix._sortear_429():
+                self._responder(
+                    429,
+                    {"error": "QUERY_LIMIT_EXCEEDED", "error_description": "Too many requests"},
+                    {"Retry-After": "1"},
+                )
+                return
+            metodo = urlsplit(self.path).path.rstrip("/").rsplit("/", 1)[-1]
+            params = _simplificar(params)
+            if metodo == "batch":
+                data = bitrix.batch(params)
+            else:
+                data = bitrix.executar(metodo, params)
+            if data is None:
+                self._responder(404, {"error": "ERROR_METHOD_NOT_FOUND"})
+                return
+            duracao = time.monotonic() - inicio
+            data["time"] = {"duration": duracao, "operating": duracao}
+            self._responder(200, data)
+
+        def do_GET(self):
+            self._tratar(parse_qs(urlsplit(self.path).query))
+
+        def do_POST(self):
+            tamanho = int(self.headers.get("Content-Length") or 0)
+            corpo = self.rfile.read(tamanho).decode()
+            params = parse_qs(urlsplit(self.path).query)
+            params.update(parse_qs(corpo))
+            self._tratar(params)
+
+    return Handler
+
+
+class ServidorBitrixFalso:
+    """Sobe o BitrixFalso numa thread; ``portal`` é o valor de BITRIX_PORTAL."""
+
+    def __init__(self, bitrix, host="127.0.0.1", porta=0):
+        self.bitrix = bitrix
+        self._servidor = ThreadingHTTPServer((host, porta), criar_handler(bitrix))
+        self._servidor.daemon_threads = True
+        self._thread = None
+
+    @property
+    def portal(self):
+        host, porta = self._servidor.server_address[:2]
+        return f"http://{host}:{porta}/rest/1"
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._servidor.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--deals", type=int, default=10000)
+    parser.add_argument("--ceps-distintos", type=int, default=5000)
+    parser.add_argument("--latencia-ms", type=float, default=0)
+    parser.add_argument("--taxa-429", type=float, default=0.0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8765)
+    args = parser.parse_args()
+
+    bitrix = BitrixFalso(args.deals, args.ceps_distintos, args.latencia_ms, args.taxa_429)
+    servidor = ServidorBitrixFalso(bitrix, args.host, args.porta)
+    print(f"🧪 Bitrix falso com {args.deals} deals em {servidor.portal}")
+    try:
+        servidor._servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
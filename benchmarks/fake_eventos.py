@@ -0,0 +1,92 @@
+"""Envia eventos de deal no formato do webhook de saída do Bitrix24.
+
+Posta ONCRMDEALADD/ONCRMDEALUPDATE/ONCRMDEALDELETE form-urlencoded em
+``/bitrix/eventos``, com IDs sorteados entre 1 e ``--deals``. Junto com o Bitrix
+falso dá para ver os deals chegarem à API sem rodar o sync:
+
+    python benchmarks/fake_bitrix.py --deals 10000
+    BITRIX_PORTAL=http://127.0.0.1:8765/rest/1 BITRIX_EVENTOS_TOKEN=teste uvicorn main:app
+    python benchmarks/fake_eventos.py --token teste --eventos 2000 --por-segundo 200
+"""
+
+import argparse
+import random
+import time
+
+import requests
+
+
+def corpo_evento(evento, deal_id, token="", dominio="exemplo.bitrix24.com.br"):
+    return {
+        "event": evento,
+        "event_handler_id": "1",
+        "data[FIELDS][ID]": str(deal_id),
+        "ts": str(int(time.time())),
+        "auth[domain]": dominio,
+        "auth[client_endpoint]": f"https://{dominio}/rest/",
+        "auth[member_id]": "0" * 32,
+        "auth[application_token]": token,
+    }
+
+
+def sortear_evento(sorteio, deals, taxa_delete, taxa_add):
+    deal_id = sorteio.randint(1, deals)
+    x = sorteio.random()
+    if x < taxa_delete:
+        return "ONCRMDEALDELETE", deal_id
+    if x < taxa_delete + taxa_add:
+        return "ONCRMDEALADD", deal_id
+    return "ONCRMDEALUPDATE", deal_id
+
+
+def enviar(url, eventos, deals, por_segundo=0, taxa_delete=0.0, taxa_add=0.1, token="", semente=1):
+    sorteio = random.Random(semente)
+    sessao = requests.Session()
+    stats = {"enviados": 0, "enfileirados": 0, "ignorados": 0, "erros": 0}
+    ids = set()
+    latencias = []
+    inicio = time.perf_counter()
+    for i in range(eventos):
+        if por_segundo:
+            atraso = inicio + i / por_segundo - time.perf_counter()
+            if atraso > 0:
+                time.sleep(atraso)
+        evento, deal_id = sortear_evento(sorteio, deals, taxa_delete, taxa_add)
+        t0 = time.perf_counter()
+        try:
+            resp = sessao.post(url, data=corpo_evento(evento, deal_id, token), timeout=10)
+            resp.raise_for_status()
+            status = resp.json().get("status")
+        except (requests.RequestException, ValueError):
+            stats["erros"] += 1
+            continue
+        finally:
+            latencias.append(time.perf_counter() - t0)
+            stats["enviados"] += 1
+        stats["enfileirados" if status == "enfileirado" else "ignorados"] += 1
+        ids.add(deal_id)
+    latencias.sort()
+    stats["deals_distintos"] = len(ids)
+    stats["duracao_s"] = round(time.perf_counter() - inicio, 2)
+    if latencias:
+        stats["p50_ms"] = round(latencias[len(latencias) // 2] * 1000, 2)
+        stats["p99_ms"] = round(latencias[int(len(latencias) * 0.99)] * 1000, 2)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000/bitrix/eventos")
+    parser.add_argument("--eventos", type=int, default=1000)
+    parser.add_argument("--deals", type=int, default=10000)
+    parser.add_argument("--por-segundo", type=float, default=0)
+    parser.add_argument("--taxa-delete", type=float, default=0.0)
+    parser.add_argument("--taxa-add", type=float, default=0.1)
+    parser.add_argument("--token", default="")
+    args = parser.parse_args()
+
+    stats = enviar(
+        args.url, args.eventos, args.deals, args.por_segundo,
+        args.taxa_delete, args.taxa_add, args.token,
+    )
+    print(f"📨 {stats}")
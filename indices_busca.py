@@ -0,0 +1,129 @@
+import argparse
+
+import psycopg2
+from psycopg2 import sql
+
+# atualizar_cache já carrega o .env; importar main traria FastAPI e os pools.
+from atualizar_cache import DB_PARAMS, DB_PARAMS_MATEUS
+
+# Colunas de endereço consultadas com LIKE/ILIKE '%valor%' em cada fonte.
+INDICES = {
+    "bitrix": {
+        "params": DB_PARAMS,
+        "schema": "public",
+        "tabela": "bitrix",
+        "colunas": ["rua", "uf_crm_bairro", "uf_crm_cidade", "uf_crm_uf"],
+    },
+    "mateus": {
+        "params": DB_PARAMS_MATEUS,
+        "schema": "public",
+        "tabela": "geral",
+        "colunas": ["rua", "bairro", "cidade", "estado"],
+    },
+}
+
+VALOR_EXPLAIN = "SAO"
+
+
+def nome_indice(tabela, coluna):
+    return f"idx_{tabela}_{coluna}_trgm"
+
+
+def colunas_existentes(cur, schema, tabela, colunas):
+    cur.execute(
+        """
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s AND column_name = ANY(%s);
+        """,
+        (schema, tabela, colunas),
+    )
+    existentes = {r[0] for r in cur.fetchall()}
+    for coluna in colunas:
+        if coluna not in existentes:
+            print(f"⚠️ Coluna {schema}.{tabela}.{coluna} não existe, ignorando.")
+    return [c for c in colunas if c in existentes]
+
+
+def criar_indices(fonte, cfg):
+    conn = psycopg2.connect(**cfg["params"])
+    # CREATE INDEX CONCURRENTLY não pode rodar dentro de transação.
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+            colunas = colunas_existentes(
+                cur, cfg["schema"], cfg["tabela"], cfg["colunas"]
+            )
+            for coluna in colunas:
+                indice = nome_indice(cfg["tabela"], coluna)
+                print(f"🛠️ [{fonte}] Criando {indice}...")
+                cur.execute(
+                    sql.SQL(
+                        "CREATE INDEX CONCURRENTLY IF NOT EXISTS {} "
+                        "ON {}.{} USING gin ({} gin_trgm_ops);"
+                    ).format(
+                        sql.Identifier(indice),
+                        sql.Identifier(cfg["schema"]),
+                        sql.Identifier(cfg["tabela"]),
+                        sql.Identifier(coluna),
+                    )
+                )
+            cur.execute(
+                sql.SQL("ANALYZE {}.{};").format(
+                    sql.Identifier(cfg["schema"]), sql.Identifier(cfg["tabela"])
+                )
+            )
+    finally:
+        conn.close()
+
+
+def verificar_planos(fonte, cfg, valor=VALOR_EXPLAIN):
+    conn = psycopg2.connect(**cfg["params"])
+    ok = True
+    try:
+        with conn.cursor() as cur:
+            colunas = colunas_existentes(
+                cur, cfg["schema"], cfg["tabela"], cfg["colunas"]
+            )
+            for coluna in colunas:
+                for operador in ("LIKE", "ILIKE"):
+                    cur.execute(
+                        sql.SQL("EXPLAIN SELECT * FROM {}.{} WHERE {} " + operador + " %s").format(
+                            sql.Identifier(cfg["schema"]),
+                            sql.Identifier(cfg["tabela"]),
+                            sql.Identifier(coluna),
+                        ),
+                        (f"%{valor}%",),
+                    )
+                    plano = "\n".join(r[0] for r in cur.fetchall())
+                    usa_indice = nome_indice(cfg["tabela"], coluna) in plano
+                    ok = ok and usa_indice
+                    print(
+                        f"{'✅' if usa_indice else '❌'} [{fonte}] {coluna} {operador}: "
+                        f"{plano.splitlines()[0]}"
+                    )
+    finally:
+        conn.close()
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Cria e verifica os índices trigram das buscas por substring."
+    )
+    parser.add_argument(
+        "--verificar",
+        action="store_true",
+        help="Só roda EXPLAIN e confere se o planner usa os índices.",
+    )
+    parser.add_argument("--fonte", choices=list(INDICES), action="append")
+    parser.add_argument("--valor", default=VALOR_EXPLAIN)
+    args = parser.parse_args()
+
+    fontes = args.fonte or list(INDICES)
+    tudo_ok = True
+    for fonte in fontes:
+        if not args.verificar:
+            criar_indices(fonte, INDICES[fonte])
+        tudo_ok = verificar_planos(fonte, INDICES[fonte], args.valor) and tudo_ok
+    raise SystemExit(0 if tudo_ok else 1)
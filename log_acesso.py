@@ -0,0 +1,140 @@
+import atexit
+import os
+import queue
+import threading
+from contextvars import ContextVar
+
+import orjson
+
+# Log de acesso estruturado (uma linha JSON por requisição). Quem atende a
+# requisição só faz um put_nowait numa fila limitada; uma thread grava em
+# lotes e rotaciona por tamanho. Com a fila cheia a linha é descartada e
+# contada, nunca bloqueia a requisição.
+
+LOG_ACESSO_PATH = os.getenv("LOG_ACESSO_PATH", "logs/requests.jsonl")
+LOG_ACESSO_BUFFER = int(os.getenv("LOG_ACESSO_BUFFER", 10000))
+LOG_ACESSO_MAX_BYTES = int(os.getenv("LOG_ACESSO_MAX_BYTES", 50 * 1024 * 1024))
+LOG_ACESSO_BACKUPS = int(os.getenv("LOG_ACESSO_BACKUPS", 5))
+LOG_ACESSO_FLUSH = float(os.getenv("LOG_ACESSO_FLUSH", 1))
+LOG_ACESSO_LOTE = 1000
+
+# Registro da requisição em andamento; os handlers acrescentam campos nele.
+requisicao_atual = ContextVar("requisicao_atual", default=None)
+
+_FIM = object()
+
+
+def anotar(**campos):
+    registro = requisicao_atual.get()
+    if registro is not None:
+        registro.update(campos)
+
+
+class LogAcesso:
+    """Fila limitada + thread escritora com rotação por tamanho."""
+
+    def __init__(
+        self,
+        caminho=LOG_ACESSO_PATH,
+        buffer=LOG_ACESSO_BUFFER,
+        max_bytes=LOG_ACESSO_MAX_BYTES,
+        backups=LOG_ACESSO_BACKUPS,
+    ):
+        self.caminho = caminho
+        self._max_bytes = max_bytes
+        self._backups = backups
+        self._fila = queue.Queue(maxsize=buffer)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._arquivo = None
+        self._tamanho = 0
+        self.stats = {"gravados": 0, "descartados": 0, "rotacoes": 0, "erros": 0}
+
+    def registrar(self, evento):
+        if self._thread is None:
+            self._iniciar()
+        try:
+            self._fila.put_nowait(evento)
+        except queue.Full:
+            self.stats["descartados"] += 1
+
+    def _iniciar(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._escrever, name="log_acesso", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.fechar)
+
+    def _abrir(self):
+        os.makedirs(os.path.dirname(self.caminho) or ".", exist_ok=True)
+        self._arquivo = open(self.caminho, "ab")
+        self._tamanho = self._arquivo.tell()
+
+    def _rotacionar(self):
+        self._arquivo.close()
+        if self._backups > 0:
+            for i in range(self._backups - 1, 0, -1):
+                if os.path.exists(f"{self.caminho}.{i}"):
+                    os.replace(f"{self.caminho}.{i}", f"{self.caminho}.{i + 1}")
+            os.replace(self.caminho, f"{self.caminho}.1")
+        else:
+            os.remove(self.caminho)
+        self.stats["rotacoes"] += 1
+        self._abrir()
+
+    def _gravar(self, lote):
+        dados = b"".join(orjson.dumps(e, default=str) + b"\n" for e in lote)
+        try:
+            if self._arquivo is None:
+                self._abrir()
+            if self._tamanho and self._tamanho + len(dados) > self._max_bytes:
+                self._rotacionar()
+            self._arquivo.write(dados)
+            self._arquivo.flush()
+            self._tamanho += len(dados)
+            self.stats["gravados"] += len(lote)
+        except OSError:
+            self.stats["erros"] += len(lote)
+            if self._arquivo is not None:
+                self._arquivo.close()
+            self._arquivo = None
+
+    def _escrever(self):
+        while True:
+            try:
+                evento = self._fila.get(timeout=LOG_ACESSO_FLUSH)
+            except queue.Empty:
+                continue
+            lote = []
+            while evento is not _FIM:
+                lote.append(evento)
+                if len(lote) >= LOG_ACESSO_LOTE:
+                    break
+                try:
+                    evento = self._fila.get_nowait()
+                except queue.Empty:
+                    break
+            if lote:
+                self._gravar(lote)
+            if evento is _FIM:
+                if self._arquivo is not None:
+                    self._arquivo.close()
+                return
+
+    def fechar(self, timeout=5):
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self._fila.put(_FIM, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def info(self):
+        return {
+            **self.stats,
+            "pendentes": self._fila.qsize(),
+            "caminho": self.caminho,
+        }
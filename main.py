@@ -1,131 +1,600 @@
-from fastapi import FastAPI, Request, Form, UploadFile, File, Body
+from fastapi import FastAPI, Request, Form, UploadFile, File, Body, HTTPException
 from fastapi.responses import (
     HTMLResponse,
     JSONResponse,
+    Response,
     StreamingResponse,
-    FileResponse,
 )
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 import io
-import pandas as pd
+import base64
+import bisect
+import codecs
+import csv
+import json
+import orjson
+from decimal import Decimal
+from openpyxl import Workbook, load_workbook
 import psycopg2
+import psycopg2.pool
+from psycopg2 import sql
 import os
 import tempfile
-import re
 from dotenv import load_dotenv
 import requests
 import logging
+import threading
+import time
+import contextvars
+import secrets
+import select
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import parse_qsl
+from itertools import chain
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeout
+from atualizar_cache import (
+    CANAL_VERSAO_DADOS,
+    CHAVE_VERSAO_DADOS,
+    DB_PARAMS_MATEUS,
+    carregar_metadados,
+    garantir_schema,
+    get_stages_em_lote,
+    normalizar_cep,
+    sincronizar_deals,
+)
+from log_acesso import LogAcesso, anotar, requisicao_atual
+from metricas import bitrix_http, etapas_atuais, registro
+from snapshot import COLUNAS_SNAPSHOT, LeitorSnapshot
 
 load_dotenv()
 
-app = FastAPI()
+
+db_etapa = registro.histograma(
+    "cep_db_segundos",
+    "Tempo no banco por fonte e etapa (acquire, execute, fetch).",
+    ("fonte", "etapa"),
+)
+formatacao = registro.histograma(
+    "cep_formatacao_segundos", "Montagem dos dicts de resposta.", ("formato",)
+)
+serializacao = registro.histograma(
+    "cep_serializacao_segundos", "Serialização JSON das respostas."
+)
+requisicoes_http = registro.histograma(
+    "cep_http_segundos",
+    "Duração total das requisições da API.",
+    ("rota", "metodo", "status"),
+)
+
+
+def _json_padrao(obj):
+    if isinstance(obj, Decimal):
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    raise TypeError(f"Tipo não serializável: {type(obj).__name__}")
+
+
+class RespostaJSON(Response):
+    """JSON serializado pelo orjson direto para bytes.
+
+    Devolvida explicitamente pelos endpoints de busca para pular o
+    jsonable_encoder do FastAPI, que percorre cada célula do resultado.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content):
+        with serializacao.cronometrar():
+            return orjson.dumps(content, default=_json_padrao)
+
+
+log_acesso = LogAcesso()
+ROTAS_SEM_LOG = ("/static", "/metrics")
+
+
+def _parametros(scope):
+    parametros = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+    parametros.update(scope.get("path_params") or {})
+    return {k: str(v).strip()[:200] for k, v in parametros.items()}
+
+
+class MedirRequisicoes:
+    """Middleware ASGI: duração por rota em /metrics e uma linha no log de acesso.
+
+    Os tempos das etapas (banco, formatação, serialização, Bitrix) medidos
+    durante a requisição entram na linha do log em ``etapas_ms``; os handlers
+    acrescentam linhas, status das fontes etc. com ``anotar``.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        inicio = time.perf_counter()
+        status = "500"
+        etapas = {}
+        registro_req = {"ts": time.time(), "metodo": scope["method"]}
+        token_etapas = etapas_atuais.set(etapas)
+        token_req = requisicao_atual.set(registro_req)
+
+        async def enviar(mensagem):
+            nonlocal status
+            if mensagem["type"] == "http.response.start":
+                status = str(mensagem["status"])
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            etapas_atuais.reset(token_etapas)
+            requisicao_atual.reset(token_req)
+            duracao = time.perf_counter() - inicio
+            rota = getattr(scope.get("route"), "path", "outra")
+            requisicoes_http.observar(duracao, rota, scope["method"], status)
+            if not scope["path"].startswith(ROTAS_SEM_LOG):
+                registro_req.update(
+                    rota=rota,
+                    params=_parametros(scope),
+                    status=int(status),
+                    duracao_ms=round(duracao * 1000, 3),
+                    etapas_ms={k: round(v * 1000, 3) for k, v in etapas.items()},
+                )
+                log_acesso.registrar(registro_req)
+
+
+app = FastAPI(default_response_class=RespostaJSON)
+app.add_middleware(MedirRequisicoes)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
-BITRIX_API_BASE = "https://marketingsolucoes.bitrix24.com.br/rest/5332/8zyo7yj1ry4k59b5"
+BITRIX_API_BASE = os.getenv(
+    "BITRIX_API_BASE",
+    "https://marketingsolucoes.bitrix24.com.br/rest/5332/8zyo7yj1ry4k59b5",
+)
 
 # Configura o log
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def get_conn():
-    return psycopg2.connect(
-        dbname=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        host=os.getenv("DB_HOST"),
-        port=os.getenv("DB_PORT"),
-    )
+EXPORT_CHUNK = int(os.getenv("EXPORT_CHUNK", 500))
+PAGINA_PADRAO = int(os.getenv("PAGINA_PADRAO", 500))
+PAGINA_MAX = int(os.getenv("PAGINA_MAX", 5000))
+# Lê CEP/endereço do snapshot local quando ele existe (ver snapshot.py).
+USAR_SNAPSHOT = os.getenv("USAR_SNAPSHOT", "1") == "1"
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+DB_POOL_CHECK_IDLE = float(os.getenv("DB_POOL_CHECK_IDLE", 30))
+
+
+class PoolConexoes:
+    """Pool limitado de conexões psycopg2 para uma fonte de dados.
+
+    Conexões ociosas há mais de DB_POOL_CHECK_IDLE segundos passam por um
+    ``SELECT 1`` antes de serem entregues; se não houver conexão livre em
+    ``timeout`` segundos, o checkout falha com TimeoutError.
+    """
+
+    def __init__(
+        self,
+        nome,
+        params,
+        minconn=DB_POOL_MIN,
+        maxconn=DB_POOL_MAX,
+        timeout=DB_POOL_TIMEOUT,
+    ):
+        self.nome = nome
+        self._params = params
+        self._min = minconn
+        self._max = maxconn
+        self._timeout = timeout
+        self._pool = None
+        self._vagas = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._devolvida_em = {}
+        self.stats = {
+            "checkouts": 0,
+            "em_uso": 0,
+            "timeouts": 0,
+            "descartadas": 0,
+            "espera_total_ms": 0.0,
+            "espera_max_ms": 0.0,
+        }
 
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = psycopg2.pool.ThreadedConnectionPool(
+                    self._min, self._max, **self._params
+                )
+            return self._pool
+
+    def _saudavel(self, conn):
+        if conn.closed:
+            return False
+        ociosa = time.monotonic() - self._devolvida_em.get(id(conn), 0)
+        if ociosa < DB_POOL_CHECK_IDLE:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self, pool):
+        conn = pool.getconn()
+        while not self._saudavel(conn):
+            self._devolver(pool, conn, descartar=True)
+            conn = pool.getconn()
+        return conn
+
+    def _devolver(self, pool, conn, descartar=False):
+        with self._lock:
+            if descartar:
+                self.stats["descartadas"] += 1
+                self._devolvida_em.pop(id(conn), None)
+            else:
+                self._devolvida_em[id(conn)] = time.monotonic()
+        pool.putconn(conn, close=descartar)
+
+    @contextmanager
+    def conexao(self):
+        inicio = time.monotonic()
+        if not self._vagas.acquire(timeout=self._timeout):
+            with self._lock:
+                self.stats["timeouts"] += 1
+            raise TimeoutError(
+                f"Pool {self.nome}: nenhuma conexão livre em {self._timeout}s"
+            )
+        try:
+            pool = self._get_pool()
+            conn = self._checkout(pool)
+            espera_ms = (time.monotonic() - inicio) * 1000
+            db_etapa.observar(espera_ms / 1000, self.nome, "acquire")
+            with self._lock:
+                self.stats["checkouts"] += 1
+                self.stats["em_uso"] += 1
+                self.stats["espera_total_ms"] += espera_ms
+                self.stats["espera_max_ms"] = max(self.stats["espera_max_ms"], espera_ms)
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+                raise
+            finally:
+                with self._lock:
+                    self.stats["em_uso"] -= 1
+                self._devolver(pool, conn, descartar=bool(conn.closed))
+        finally:
+            self._vagas.release()
+
+    def info(self):
+        with self._lock:
+            checkouts = self.stats["checkouts"]
+            return {
+                **self.stats,
+                "min": self._min,
+                "max": self._max,
+                "ocupacao": self.stats["em_uso"] / self._max,
+                "espera_media_ms": (
+                    self.stats["espera_total_ms"] / checkouts if checkouts else 0.0
+                ),
+            }
 
-def get_conn_mateus():
-    return psycopg2.connect(
-        dbname=os.getenv("DB_NAME_MATEUS"),
-        user=os.getenv("DB_USER_MATEUS"),
-        password=os.getenv("DB_PASSWORD_MATEUS"),
-        host=os.getenv("DB_HOST_MATEUS"),
-        port=os.getenv("DB_PORT_MATEUS"),
-    )
 
+DB_PARAMS = {
+    "dbname": os.getenv("DB_NAME"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+    "host": os.getenv("DB_HOST"),
+    "port": os.getenv("DB_PORT"),
+}
 
-def get_categories():
-    try:
-        resp = requests.get(
-            f"{BITRIX_API_BASE}/crm.category.list", params={"entityTypeId": 2}
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        return {
-            cat["id"]: cat["name"]
-            for cat in data.get("result", {}).get("categories", [])
-        }
-    except Exception as e:
-        logger.error(f"Erro ao buscar categorias do Bitrix: {e}")
-        return {}
+pool_bitrix = PoolConexoes("bitrix", DB_PARAMS)
+pool_mateus = PoolConexoes("mateus", DB_PARAMS_MATEUS)
 
 
-def get_stages(category_id):
+def get_conn():
+    return pool_bitrix.conexao()
+
+
+def get_conn_mateus():
+    return pool_mateus.conexao()
+
+
+METADATA_TTL = int(os.getenv("BITRIX_METADATA_TTL", 600))
+METADATA_RETRY = int(os.getenv("BITRIX_METADATA_RETRY", 30))
+METADATA_TIMEOUT = int(os.getenv("BITRIX_METADATA_TIMEOUT", 15))
+
+
+class CacheTTL:
+    """Cache de processo com TTL, refresh em segundo plano e single-flight por chave.
+
+    Entradas expiradas continuam sendo servidas enquanto uma única thread busca
+    o valor novo; se o Bitrix falhar, o valor antigo é mantido.
+    """
+
+    def __init__(self, nome, carregar, ttl=METADATA_TTL):
+        self.nome = nome
+        self._carregar = carregar
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entradas = {}
+        self._em_voo = {}
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "refreshes": 0, "erros": 0}
+
+    def get(self, chave=None):
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None and agora < entrada[1]:
+                self.stats["hits"] += 1
+                return entrada[0]
+
+            evento = self._em_voo.get(chave)
+            lider = evento is None
+            if lider:
+                evento = self._em_voo[chave] = threading.Event()
+
+            if entrada is not None:
+                self.stats["stale"] += 1
+                if lider:
+                    threading.Thread(
+                        target=self._atualizar, args=(chave, evento), daemon=True
+                    ).start()
+                return entrada[0]
+            self.stats["misses"] += 1
+
+        if lider:
+            self._atualizar(chave, evento)
+        else:
+            evento.wait(METADATA_TIMEOUT)
+
+        with self._lock:
+            entrada = self._entradas.get(chave)
+        return entrada[0] if entrada is not None else {}
+
+    def _atualizar(self, chave, evento):
+        try:
+            valor = self._carregar(chave)
+            with self._lock:
+                self._entradas[chave] = (valor, time.monotonic() + self._ttl)
+                self.stats["refreshes"] += 1
+        except Exception as e:
+            logger.error(f"Erro ao atualizar cache {self.nome} ({chave}): {e}")
+            with self._lock:
+                self.stats["erros"] += 1
+                entrada = self._entradas.get(chave)
+                valor = entrada[0] if entrada is not None else {}
+                self._entradas[chave] = (valor, time.monotonic() + METADATA_RETRY)
+        finally:
+            with self._lock:
+                self._em_voo.pop(chave, None)
+            evento.set()
+
+    def info(self):
+        with self._lock:
+            return {**self.stats, "entradas": len(self._entradas), "ttl": self._ttl}
+
+
+def _buscar_categorias(_chave=None):
+    inicio = time.perf_counter()
+    status = "erro"
     try:
         resp = requests.get(
-            f"{BITRIX_API_BASE}/crm.dealcategory.stage.list", params={"id": category_id}
+            f"{BITRIX_API_BASE}/crm.category.list",
+            params={"entityTypeId": 2},
+            timeout=METADATA_TIMEOUT,
         )
-        resp.raise_for_status()
-        data = resp.json()
-        return {stage["STATUS_ID"]: stage["NAME"] for stage in data.get("result", [])}
-    except Exception as e:
-        logger.error(f"Erro ao buscar stages do Bitrix (categoria {category_id}): {e}")
-        return {}
+        status = str(resp.status_code)
+    finally:
+        bitrix_http.observar(time.perf_counter() - inicio, "crm.category.list", status)
+    resp.raise_for_status()
+    data = resp.json()
+    return {
+        cat["id"]: cat["name"] for cat in data.get("result", {}).get("categories", [])
+    }
+
+
+def _buscar_stages(_chave=None):
+    # Estágios de todas as categorias numa única chamada batch do Bitrix. Sem
+    # as retentativas do sync: com o cache frio uma requisição espera por isto.
+    category_ids = list(get_categories())
+    stages, falhas = get_stages_em_lote(
+        category_ids, tentativas=1, timeout=METADATA_TIMEOUT
+    )
+    if falhas:
+        raise RuntimeError(f"categorias sem estágios: {', '.join(map(str, falhas))}")
+    return {str(cat_id): valor for cat_id, valor in stages.items()}
 
 
-def montar_resultado(rows):
-    categorias = get_categories()
-    stages_cache = {}
+cache_categorias = CacheTTL("categorias", _buscar_categorias)
+cache_stages = CacheTTL("stages", _buscar_stages)
 
-    resultados = []
-    for r in rows:
-        cat_id = r[3]
-        categoria_nome = categorias.get(cat_id, str(cat_id))
-
-        if cat_id not in stages_cache:
-            stages_cache[cat_id] = get_stages(cat_id)
-        fase_nome = stages_cache[cat_id].get(r[2], r[2])
-
-        resultados.append(
-            {
-                "id": r[0],
-                "cliente": formatar_dado(r[1]),
-                "fase": formatar_dado(fase_nome),
-                "categoria": formatar_dado(categoria_nome),
-                "uf_crm_cep": formatar_dado(r[4]),
-                "contato": formatar_dado(r[5]),
-                "criado_em": (
-                    r[6].isoformat()
-                    if hasattr(r[6], "isoformat")
-                    else formatar_dado(r[6])
-                ),
-                "contato01": formatar_dado(r[7]),
-                "contato02": formatar_dado(r[8]),
-                "ordem_de_servico": formatar_dado(r[9]),
-                "nome_do_cliente": formatar_dado(r[10]),
-                "nome_da_mae": formatar_dado(r[11]),
-                "data_de_vencimento": formatar_dado(r[12]),
-                "email": formatar_dado(r[13]),
-                "cpf": formatar_dado(r[14]),
-                "rg": formatar_dado(r[15]),
-                "referencia": formatar_dado(r[16]),
-                "rua": formatar_dado(r[17]),
-                "data_de_instalacao": formatar_dado(r[18]),
-                "quais_operadoras_tem_viabilidade": formatar_dado(r[19]),
-                "uf_crm_bairro": formatar_dado(r[20]),
-                "uf_crm_cidade": formatar_dado(r[21]),
-                "uf_crm_numero": formatar_dado(r[22]),
-                "uf_crm_uf": formatar_dado(r[23]),
-                "base": formatar_dado(r[27]),
+
+RESULTADO_CACHE_BYTES = int(os.getenv("RESULTADO_CACHE_BYTES", 64 * 1024 * 1024))
+RESULTADO_CACHE_TTL = int(os.getenv("RESULTADO_CACHE_TTL", 3600))
+VERSAO_RECONEXAO = float(os.getenv("VERSAO_RECONEXAO", 5))
+
+
+class VersaoDados:
+    """Versão dos dados da tabela bitrix, mantida pelo sync em sync_estado.
+
+    Uma thread escuta o NOTIFY que o sync emite a cada commit. Enquanto a
+    escuta não está ativa ``atual`` devolve None, e quem depende da versão
+    deve ignorar o cache.
+    """
+
+    def __init__(self, params, canal=CANAL_VERSAO_DADOS):
+        self._params = params
+        self._canal = canal
+        self._versao = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def atual(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._escutar, name="versao_dados", daemon=True
+                    )
+                    self._thread.start()
+        return self._versao
+
+    def _ler_versao(self, cur):
+        try:
+            cur.execute(
+                "SELECT valor FROM sync_estado WHERE chave = %s;",
+                (CHAVE_VERSAO_DADOS,),
+            )
+        except psycopg2.errors.UndefinedTable:
+            # Nenhum sync rodou ainda; o primeiro commit chega pelo NOTIFY.
+            return "0"
+        row = cur.fetchone()
+        return row[0] if row else "0"
+
+    def _escutar(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**self._params)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    # LISTEN antes da leitura: nenhum commit fica sem aviso.
+                    cur.execute(sql.SQL("LISTEN {};").format(sql.Identifier(self._canal)))
+                    self._versao = self._ler_versao(cur)
+                    logger.info(f"Versão dos dados: {self._versao}")
+                    while True:
+                        if select.select([conn], [], [], 60) == ([], [], []):
+                            cur.execute("SELECT 1;")
+                            continue
+                        conn.poll()
+                        while conn.notifies:
+                            self._versao = conn.notifies.pop(0).payload
+            except Exception as e:
+                self._versao = None
+                logger.warning(f"Escuta da versão dos dados interrompida: {e}")
+                time.sleep(VERSAO_RECONEXAO)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+class CacheResultados:
+    """LRU de respostas JSON já serializadas, limitado em bytes.
+
+    Cada entrada vale para uma versão dos dados: quando a versão muda o cache
+    inteiro é descartado. Com versão None nada é lido nem gravado.
+    """
+
+    def __init__(self, nome, max_bytes=RESULTADO_CACHE_BYTES, ttl=RESULTADO_CACHE_TTL):
+        self.nome = nome
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self._versao = None
+        self._bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidacoes": 0}
+
+    def _conferir_versao(self, versao):
+        if versao != self._versao:
+            if self._entradas:
+                self.stats["invalidacoes"] += 1
+            self._entradas.clear()
+            self._bytes = 0
+            self._versao = versao
+
+    def get(self, chave, versao):
+        if versao is None or self._max_bytes <= 0:
+            return None
+        with self._lock:
+            self._conferir_versao(versao)
+            entrada = self._entradas.get(chave)
+            if entrada is None or time.monotonic() >= entrada[1]:
+                self.stats["misses"] += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.stats["hits"] += 1
+            return entrada[0], entrada[2]
+
+    def guardar(self, chave, versao, corpo, meta=None):
+        if versao is None or len(corpo) > self._max_bytes:
+            return
+        with self._lock:
+            self._conferir_versao(versao)
+            anterior = self._entradas.pop(chave, None)
+            if anterior is not None:
+                self._bytes -= len(anterior[0])
+            self._entradas[chave] = (corpo, time.monotonic() + self._ttl, meta or {})
+            self._bytes += len(corpo)
+            while self._bytes > self._max_bytes:
+                _, (velho, _, _) = self._entradas.popitem(last=False)
+                self._bytes -= len(velho)
+                self.stats["evictions"] += 1
+
+    def info(self):
+        with self._lock:
+            return {
+                **self.stats,
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "max_bytes": self._max_bytes,
+                "versao": self._versao,
             }
-        )
-    return resultados
+
+
+versao_dados = VersaoDados(DB_PARAMS)
+cache_resultados = CacheResultados("resultados")
+
+
+def resposta_cacheada(chave, produzir):
+    # Repetições da mesma consulta, na mesma versão dos dados, devolvem os
+    # bytes já serializados sem tocar no banco.
+    versao = versao_dados.atual()
+    entrada = cache_resultados.get(chave, versao)
+    if entrada is None:
+        resultado = produzir()
+        corpo = RespostaJSON(resultado).body
+        meta = {"linhas": len(resultado.get("resultados") or ())}
+        if "fontes" in resultado:
+            meta["fontes"] = resultado["fontes"]
+        # Resposta parcial (fonte com timeout/erro) não entra no cache: a
+        # próxima requisição tenta de novo em vez de servir a versão degradada.
+        if not resultado.get("parcial"):
+            cache_resultados.guardar(chave, versao, corpo, meta)
+        anotar(cache="miss", **meta)
+    else:
+        corpo, meta = entrada
+        anotar(cache="hit", **meta)
+    return Response(content=corpo, media_type="application/json")
+
+
+def get_categories():
+    return cache_categorias.get()
+
+
+def get_stages(category_id):
+    return cache_stages.get().get(str(category_id), {})
 
 
 def formatar_dado(dado):
@@ -136,187 +605,616 @@ def formatar_dado(dado):
     return str(dado)
 
 
-def buscar_por_cep(cep):
-    cep_limpo = re.sub(r"\D", "", cep)
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT 
-                    "id", "title", "stage_id", "category_id", 
-                    TRIM("uf_crm_cep") as uf_crm_cep, 
-                    "uf_crm_contato", "date_create", "contato01", "contato02", 
-                    "ordem_de_servico", 
-                    TRIM("nome_do_cliente") as nome_do_cliente,
-                    "nome_da_mae", 
-                    "data_de_vencimento", "email", "cpf", "rg", "referencia", 
-                    TRIM("rua") as rua,
-                    "data_de_instalacao", "quais_operadoras_tem_viabilidade",
-                    TRIM("uf_crm_bairro") as uf_crm_bairro,
-                    TRIM("uf_crm_cidade") as uf_crm_cidade,
-                    "uf_crm_numero", "uf_crm_uf"
-                FROM bitrix
-                WHERE regexp_replace("uf_crm_cep", '[^0-9]', '', 'g') = %s;
-                """,
-                (cep_limpo,),
-            )
-            rows = cur.fetchall()
-    return montar_resultado(rows)
+def formatar_data(dado):
+    return dado.isoformat() if hasattr(dado, "isoformat") else formatar_dado(dado)
 
 
-def buscar_por_rua(rua):
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT * FROM bitrix
-                WHERE rua ILIKE %s;
-                """,
-                (f"%{rua.strip()}%",),
-            )
-            rows = cur.fetchall()
-    return montar_resultado(rows)
+def _cru(valor):
+    return valor
 
 
-def buscar_por_bairro(bairro):
-    result: list = []
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                'SELECT * FROM bitrix WHERE "uf_crm_bairro" ILIKE %s;',
-                (f"%{bairro.strip()}%",),
-            )
-            rows_bitrix = cur.fetchall()
-            result.extend(rows_bitrix)
-    return montar_resultado(rows_bitrix)
+def compilar_formato(nome, campos):
+    """Monta uma vez a função que transforma uma linha do banco em dict.
 
+    ``campos`` é uma lista de ``(chave, indice, conversor)``; com conversor
+    None o valor vai cru. Chaves, ``itemgetter`` dos índices e conversores
+    ficam prontos aqui; sem conversor nenhum a linha vira dict direto pelo
+    ``zip``. ``nome`` identifica o formato nas métricas.
+    """
+    chaves = tuple(chave for chave, _, _ in campos)
+    indices = [indice for _, indice, _ in campos]
+    pegar = itemgetter(*indices) if len(indices) > 1 else lambda r: (r[indices[0]],)
+    conversores = tuple(conversor or _cru for _, _, conversor in campos)
 
-def buscar_por_cidade(cidade):
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                'SELECT * FROM bitrix WHERE "uf_crm_cidade" ILIKE %s;',
-                (f"%{cidade.strip()}%",),
+    if all(conversor is _cru for conversor in conversores):
+        def formato(r):
+            return dict(zip(chaves, pegar(r)))
+    else:
+        def formato(r):
+            return {
+                chave: converter(valor)
+                for chave, converter, valor in zip(chaves, conversores, pegar(r))
+            }
+    formato.__name__ = nome
+    return formato
+
+
+# Chaves da resposta e a posição de cada uma nas linhas da tabela bitrix.
+# "fase" e "categoria" são preenchidas depois, a partir dos metadados do Bitrix.
+CAMPOS_BITRIX = [
+    ("id", 0),
+    ("cliente", 1),
+    ("fase", 2),
+    ("categoria", 3),
+    ("uf_crm_cep", 4),
+    ("contato", 5),
+    ("criado_em", 6),
+    ("contato01", 7),
+    ("contato02", 8),
+    ("ordem_de_servico", 9),
+    ("nome_do_cliente", 10),
+    ("nome_da_mae", 11),
+    ("data_de_vencimento", 12),
+    ("email", 13),
+    ("cpf", 14),
+    ("rg", 15),
+    ("referencia", 16),
+    ("rua", 17),
+    ("data_de_instalacao", 18),
+    ("quais_operadoras_tem_viabilidade", 19),
+    ("uf_crm_bairro", 20),
+    ("uf_crm_cidade", 21),
+    ("uf_crm_numero", 22),
+    ("uf_crm_uf", 23),
+]
+
+COLUNAS_CEP = [chave for chave, _ in CAMPOS_BITRIX]
+
+
+def _conversor_bitrix(chave):
+    if chave in ("id", "fase", "categoria"):
+        return None
+    if chave == "criado_em":
+        return formatar_data
+    return formatar_dado
+
+
+# SELECT * FROM bitrix: valores crus, tratados em Python; "base" é a coluna 27.
+FORMATO_BITRIX = compilar_formato(
+    "bitrix",
+    [(chave, i, _conversor_bitrix(chave)) for chave, i in CAMPOS_BITRIX]
+    + [("base", 27, formatar_dado)]
+)
+
+# SQL_CAMPOS_CEP e o snapshot já devolvem texto com TRIM/COALESCE feitos.
+FORMATO_CEP = compilar_formato("cep", [(chave, i, None) for chave, i in CAMPOS_BITRIX])
+
+# Buscas por endereço no snapshot: mesmo formato do FORMATO_BITRIX, com "base".
+FORMATO_SNAPSHOT = compilar_formato(
+    "snapshot",
+    [(chave, i, None) for chave, i in CAMPOS_BITRIX] + [("base", len(CAMPOS_BITRIX), None)]
+)
+
+FORMATO_MATEUS = compilar_formato(
+    "mateus",
+    [
+        ("cpf", 0, None),
+        ("nome_do_cliente", 1, None),
+        ("contato01", 2, None),
+        ("rua", 3, None),
+        ("uf_crm_numero", 4, None),
+        ("uf_crm_bairro", 5, None),
+        ("uf_crm_cep", 6, None),
+        ("uf_crm_cidade", 7, None),
+        ("uf_crm_uf", 8, None),
+        ("email", 9, None),
+        ("base", 10, None),
+    ]
+)
+
+
+def formatar_linhas(rows, formato=FORMATO_BITRIX):
+    categorias = get_categories()
+    # Nome da fase/categoria resolvido uma vez por par (categoria, estágio).
+    nomes = {}
+
+    for r in rows:
+        resultado = formato(r)
+        chave = (r[3], r[2])
+        par = nomes.get(chave)
+        if par is None:
+            cat_id, stage_id = chave
+            par = nomes[chave] = (
+                formatar_dado(get_stages(cat_id).get(stage_id, stage_id)),
+                formatar_dado(categorias.get(cat_id, str(cat_id))),
             )
-            rows = cur.fetchall()
-    return montar_resultado(rows)
+        resultado["fase"], resultado["categoria"] = par
+        yield resultado
 
 
-def buscar_por_estado(estado):
+def montar_resultado(rows, formato=FORMATO_BITRIX):
+    with formatacao.cronometrar(formato.__name__):
+        return list(formatar_linhas(rows, formato))
+
+
+def padrao_contem(valor):
+    # Escapa curingas do LIKE para que a busca seja por substring literal;
+    # o padrão '%...%' é atendido pelos índices trigram (ver indices_busca.py).
+    valor = valor.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{valor}%"
+
+
+SQL_CAMPOS_CEP = (
+    "SELECT "
+    + ", ".join(expr for _, expr in COLUNAS_SNAPSHOT[: len(CAMPOS_BITRIX)])
+    + " FROM bitrix "
+)
+
+leitor_snapshot = LeitorSnapshot()
+
+
+def snapshot_disponivel():
+    return USAR_SNAPSHOT and leitor_snapshot.disponivel()
+
+
+def buscar_por_cep(cep):
+    cep_limpo = normalizar_cep(cep)
+    if snapshot_disponivel():
+        with db_etapa.cronometrar("snapshot", "consulta"):
+            rows = list(leitor_snapshot.buscar_ceps([cep_limpo]))
+    else:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                with db_etapa.cronometrar("bitrix", "execute"):
+                    cur.execute(
+                        SQL_CAMPOS_CEP + 'WHERE "cep_normalizado" = %s;', (cep_limpo,)
+                    )
+                with db_etapa.cronometrar("bitrix", "fetch"):
+                    rows = cur.fetchall()
+    return montar_resultado(rows, FORMATO_CEP)
+
+
+def codificar_cursor(posicoes):
+    return base64.urlsafe_b64encode(json.dumps(posicoes).encode()).decode()
+
+
+def _id_valido(posicao):
+    return isinstance(posicao, int) and not isinstance(posicao, bool)
+
+
+def decodificar_cursor(cursor, validos=None):
+    # ``validos`` mapeia cada chave aceita a uma função que confere a posição;
+    # o valor vai direto para o keyset, então um tipo errado vira 400, não 500.
+    if not cursor:
+        return {}
+    validos = validos or {"id": _id_valido}
+    try:
+        posicoes = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        posicoes = None
+    if not isinstance(posicoes, dict) or not all(
+        chave in validos and validos[chave](posicao)
+        for chave, posicao in posicoes.items()
+    ):
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
+    return posicoes
+
+
+def limitar_pagina(limit):
+    return max(1, min(limit, PAGINA_MAX))
+
+
+def buscar_por_coluna(coluna, valor, limit=PAGINA_PADRAO, cursor=None, contar=False):
+    # Keyset por id: cada página continua de onde a anterior parou, sem OFFSET,
+    # lida por um cursor nomeado. O total só é calculado se pedido ou se a
+    # primeira página já trouxe tudo.
+    depois = decodificar_cursor(cursor).get("id")
+    if snapshot_disponivel():
+        return buscar_por_coluna_snapshot(coluna, valor, limit, depois, contar)
+    filtro = sql.SQL("{} ILIKE %s").format(sql.Identifier(coluna))
+    args = [padrao_contem(valor.strip())]
+    keyset = sql.SQL("")
+    if depois is not None:
+        keyset = sql.SQL(" AND id > %s")
+        args.append(depois)
+
     with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                'SELECT * FROM bitrix WHERE "uf_crm_uf" ILIKE %s;',
-                (f"%{estado.strip()}%",),
-            )
-            rows = cur.fetchall()
-    return montar_resultado(rows)
+        with conn.cursor(name="buscar_por_coluna") as cur:
+            cur.itersize = limit
+            with db_etapa.cronometrar("bitrix", "execute"):
+                cur.execute(
+                    sql.SQL("SELECT * FROM bitrix WHERE {}{} ORDER BY id LIMIT %s").format(
+                        filtro, keyset
+                    ),
+                    args + [limit],
+                )
+            with db_etapa.cronometrar("bitrix", "fetch"):
+                rows = cur.fetchall()
+
+        total = None
+        if contar:
+            with conn.cursor() as cur, db_etapa.cronometrar("bitrix", "count"):
+                cur.execute(
+                    sql.SQL("SELECT count(*) FROM bitrix WHERE {}").format(filtro),
+                    args[:1],
+                )
+                total = cur.fetchone()[0]
+        elif depois is None and len(rows) < limit:
+            total = len(rows)
+
+    proximo = codificar_cursor({"id": rows[-1][0]}) if len(rows) == limit else None
+    return {
+        "total": total,
+        "resultados": montar_resultado(rows),
+        "proximo_cursor": proximo,
+    }
+
+
+def buscar_por_coluna_snapshot(coluna, valor, limit, depois, contar):
+    valor = valor.strip()
+    with db_etapa.cronometrar("snapshot", "consulta"):
+        rows = leitor_snapshot.buscar_contem(coluna, valor, limit, depois)
+    total = None
+    if contar:
+        with db_etapa.cronometrar("snapshot", "count"):
+            total = leitor_snapshot.contar_contem(coluna, valor)
+    elif depois is None and len(rows) < limit:
+        total = len(rows)
+    proximo = codificar_cursor({"id": rows[-1][0]}) if len(rows) == limit else None
+    return {
+        "total": total,
+        "resultados": montar_resultado(rows, FORMATO_SNAPSHOT),
+        "proximo_cursor": proximo,
+    }
+
+
+def buscar_por_rua(rua, limit=PAGINA_PADRAO, cursor=None, contar=False):
+    return buscar_por_coluna("rua", rua, limit, cursor, contar)
+
+
+def buscar_por_bairro(bairro, limit=PAGINA_PADRAO, cursor=None, contar=False):
+    return buscar_por_coluna("uf_crm_bairro", bairro, limit, cursor, contar)
+
+
+def buscar_por_cidade(cidade, limit=PAGINA_PADRAO, cursor=None, contar=False):
+    return buscar_por_coluna("uf_crm_cidade", cidade, limit, cursor, contar)
+
+
+def buscar_por_estado(estado, limit=PAGINA_PADRAO, cursor=None, contar=False):
+    return buscar_por_coluna("uf_crm_uf", estado, limit, cursor, contar)
+
+
+def resposta_cep(cep):
+    def produzir():
+        resultados = buscar_por_cep(cep)
+        return {"total": len(resultados), "resultados": resultados}
+
+    return resposta_cacheada(("cep", normalizar_cep(cep)), produzir)
 
 
 @app.get("/buscar-cep")
 def buscar_cep_endpoint(cep: str):
-    resultados = buscar_por_cep(cep)
-    return {"total": len(resultados), "resultados": resultados}
+    return resposta_cep(cep)
+
+
+def consultar_lotes_ceps(ceps, progresso=None):
+    # CEPs já normalizados e sem repetição, consultados em lotes de CEP_LOTE;
+    # cada lote é lido por um cursor nomeado, então a memória não cresce com
+    # o tamanho do arquivo.
+    def lotes():
+        lote = []
+        for cep in ceps:
+            lote.append(cep)
+            if len(lote) >= CEP_LOTE:
+                yield lote
+                lote = []
+        if lote:
+            yield lote
+
+    def consultar(lote, cur=None):
+        if cur is None:
+            rows = leitor_snapshot.buscar_ceps(lote)
+        else:
+            cur.itersize = EXPORT_CHUNK
+            cur.execute(SQL_CAMPOS_CEP + 'WHERE "cep_normalizado" = ANY(%s);', (lote,))
+            rows = cur
+        for linha in formatar_linhas(rows, FORMATO_CEP):
+            if progresso is not None:
+                progresso["registros"] += 1
+            yield linha
+        if progresso is not None:
+            progresso["ceps_consultados"] += len(lote)
+            salvar_progresso(progresso)
+
+    try:
+        if snapshot_disponivel():
+            for lote in lotes():
+                yield from consultar(lote)
+        else:
+            with get_conn() as conn:
+                for lote in lotes():
+                    with conn.cursor(name="buscar_varios_ceps") as cur:
+                        yield from consultar(lote, cur)
+    except Exception:
+        if progresso is not None:
+            progresso["status"] = "erro"
+            salvar_progresso(progresso)
+        raise
+    if progresso is not None:
+        progresso["status"] = "concluido"
+        progresso["duracao_s"] = time.time() - progresso["iniciado_em"]
+        salvar_progresso(progresso)
+        anotar(linhas=progresso["registros"], ceps=progresso["ceps_consultados"])
+
+
+def iterar_varios_ceps(lista_ceps, progresso=None):
+    return consultar_lotes_ceps(ceps_unicos(lista_ceps, progresso), progresso)
 
 
 def buscar_varios_ceps(lista_ceps):
-    ceps_limpos = [c.replace("-", "").strip() for c in lista_ceps if c.strip()]
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT 
-                    "id", "title", "stage_id", "category_id", 
-                    TRIM("uf_crm_cep") as uf_crm_cep, 
-                    "uf_crm_contato", "date_create", "contato01", "contato02", 
-                    "ordem_de_servico", 
-                    TRIM("nome_do_cliente") as nome_do_cliente,
-                    "nome_da_mae", 
-                    "data_de_vencimento", "email", "cpf", "rg", "referencia", 
-                    TRIM("rua") as rua,
-                    "data_de_instalacao", "quais_operadoras_tem_viabilidade",
-                    TRIM("uf_crm_bairro") as uf_crm_bairro,
-                    TRIM("uf_crm_cidade") as uf_crm_cidade,
-                    "uf_crm_numero", "uf_crm_uf"
-                FROM bitrix
-                WHERE replace("uf_crm_cep", '-', '') = ANY(%s);
-                """,
-                (ceps_limpos,),
-            )
-            rows = cur.fetchall()
+    return list(iterar_varios_ceps(lista_ceps))
 
-    categorias = get_categories()
-    stages_cache = {}
 
-    resultados = []
-    for r in rows:
-        cat_id = r[3]
-        categoria_nome = categorias.get(cat_id, str(cat_id))
-
-        if cat_id not in stages_cache:
-            stages_cache[cat_id] = get_stages(cat_id)
-        fase_nome = stages_cache[cat_id].get(r[2], r[2])
-
-        resultados.append(
-            {
-                "id": r[0],
-                "cliente": formatar_dado(r[1]),
-                "fase": formatar_dado(fase_nome),
-                "categoria": formatar_dado(categoria_nome),
-                "uf_crm_cep": formatar_dado(r[4]),
-                "contato": formatar_dado(r[5]),
-                "criado_em": (
-                    r[6].isoformat()
-                    if hasattr(r[6], "isoformat")
-                    else formatar_dado(r[6])
-                ),
-                "contato01": formatar_dado(r[7]),
-                "contato02": formatar_dado(r[8]),
-                "ordem_de_servico": formatar_dado(r[9]),
-                "nome_do_cliente": formatar_dado(r[10]),
-                "nome_da_mae": formatar_dado(r[11]),
-                "data_de_vencimento": formatar_dado(r[12]),
-                "email": formatar_dado(r[13]),
-                "cpf": formatar_dado(r[14]),
-                "rg": formatar_dado(r[15]),
-                "referencia": formatar_dado(r[16]),
-                "rua": formatar_dado(r[17]),
-                "data_de_instalacao": formatar_dado(r[18]),
-                "quais_operadoras_tem_viabilidade": formatar_dado(r[19]),
-                "uf_crm_bairro": formatar_dado(r[20]),
-                "uf_crm_cidade": formatar_dado(r[21]),
-                "uf_crm_numero": formatar_dado(r[22]),
-                "uf_crm_uf": formatar_dado(r[23]),
-            }
-        )
-    return resultados
+def _em_blocos(linhas, formatar):
+    bloco = []
+    for linha in linhas:
+        bloco.append(formatar(linha))
+        if len(bloco) >= EXPORT_CHUNK:
+            yield "".join(bloco).encode("utf-8")
+            bloco = []
+    yield "".join(bloco).encode("utf-8")
 
 
-async def extrair_ceps_arquivo(arquivo: UploadFile):
-    nome = arquivo.filename.lower()
-    conteudo = await arquivo.read()
-    ceps = []
+def exportar_txt(linhas):
+    return _em_blocos(linhas, lambda linha: str(linha) + "\n")
 
+
+def exportar_ndjson(linhas):
+    return _em_blocos(
+        linhas,
+        lambda linha: orjson.dumps(
+            linha, default=_json_padrao, option=orjson.OPT_APPEND_NEWLINE
+        ).decode("utf-8"),
+    )
+
+
+def exportar_csv(linhas):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=COLUNAS_CEP)
+
+    def formatar(linha):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(linha)
+        return buffer.getvalue()
+
+    # BOM para o Excel abrir o CSV como UTF-8.
+    yield ("\ufeff" + ",".join(COLUNAS_CEP) + "\r\n").encode("utf-8")
+    yield from _em_blocos(linhas, formatar)
+
+
+def exportar_xlsx(linhas):
+    # XLSX é um zip e só fica válido depois do save; o modo write-only do
+    # openpyxl mantém a memória constante e o arquivo vai para um temporário
+    # que é apagado ao fim do envio.
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("resultado")
+    ws.append(COLUNAS_CEP)
+    for linha in linhas:
+        ws.append([linha[c] for c in COLUNAS_CEP])
+    with tempfile.TemporaryFile() as tmp:
+        wb.save(tmp)
+        tmp.seek(0)
+        while bloco := tmp.read(64 * 1024):
+            yield bloco
+
+
+FORMATOS_EXPORT = {
+    "txt": (exportar_txt, "text/plain", "resultado.txt"),
+    "csv": (exportar_csv, "text/csv; charset=utf-8", "resultado.csv"),
+    "ndjson": (exportar_ndjson, "application/x-ndjson", "resultado.ndjson"),
+    "xlsx": (
+        exportar_xlsx,
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "resultado.xlsx",
+    ),
+}
+
+
+CEP_LOTE = int(os.getenv("CEP_LOTE", 1000))
+IMPORTACOES_MAX = int(os.getenv("IMPORTACOES_MAX", 100))
+# Progresso das importações, compartilhado entre os workers do uvicorn.
+IMPORTACOES_DIR = os.getenv("IMPORTACOES_DIR", "importacoes")
+
+
+def _coluna_cep(cabecalho):
+    for i, coluna in enumerate(cabecalho):
+        if coluna is not None and "cep" in str(coluna).lower():
+            return i
+    return None
+
+
+def celulas_cep(arquivo: UploadFile):
+    """Lê o upload aos poucos e devolve só os valores da coluna de CEP."""
+    nome = arquivo.filename.lower()
+    arquivo.file.seek(0)
+
+    if nome.endswith(".xlsx"):
+        wb = load_workbook(arquivo.file, read_only=True, data_only=True)
+        try:
+            linhas = wb.active.iter_rows(values_only=True)
+            coluna = _coluna_cep(next(linhas, ()))
+            if coluna is None:
+                return
+            for linha in linhas:
+                valor = linha[coluna] if coluna < len(linha) else None
+                # CEP numérico no Excel perde o zero à esquerda.
+                if isinstance(valor, (int, float)):
+                    valor = f"{int(valor):08d}"
+                yield valor
+        finally:
+            wb.close()
+        return
+
+    if not nome.endswith((".txt", ".csv")):
+        return
+    # Decodifica linha a linha direto dos bytes: no Python 3.10 o
+    # SpooledTemporaryFile do upload não tem readable() e não aceita TextIOWrapper.
+    texto = codecs.iterdecode(arquivo.file, "utf-8-sig", errors="replace")
     if nome.endswith(".txt"):
-        ceps = conteudo.decode().splitlines()
-    elif nome.endswith(".csv"):
-        df = pd.read_csv(io.BytesIO(conteudo))
-        for col in df.columns:
-            if "cep" in col.lower():
-                ceps = df[col].astype(str).tolist()
-                break
-    elif nome.endswith(".xlsx"):
-        df = pd.read_excel(io.BytesIO(conteudo))
-        for col in df.columns:
-            if "cep" in col.lower():
-                ceps = df[col].astype(str).tolist()
-                break
-    return ceps
-
-
-def select_from_database(param: str, value: str, source: str):
-    conn = None
-    rows = None
+        yield from texto
+        return
+    cabecalho = next(texto, "")
+    try:
+        dialeto = csv.Sniffer().sniff(cabecalho, delimiters=",;\t")
+    except csv.Error:
+        dialeto = csv.excel
+    coluna = _coluna_cep(next(csv.reader([cabecalho], dialeto), ()))
+    if coluna is None:
+        return
+    for linha in csv.reader(texto, dialeto):
+        yield linha[coluna] if coluna < len(linha) else None
+
+
+def ceps_unicos(valores, progresso=None):
+    vistos = set()
+    for valor in valores:
+        if progresso is not None:
+            progresso["linhas"] += 1
+        cep = normalizar_cep(valor)
+        if cep is None:
+            if progresso is not None:
+                progresso["invalidos"] += 1
+        elif cep in vistos:
+            if progresso is not None:
+                progresso["duplicados"] += 1
+        else:
+            vistos.add(cep)
+            yield cep
+
+
+def _caminho_importacao(importacao_id):
+    return os.path.join(IMPORTACOES_DIR, f"{importacao_id}.json")
+
+
+def salvar_progresso(progresso):
+    # Um arquivo por importação, trocado com os.replace: qualquer worker do
+    # uvicorn responde a GET /buscar/progresso/{id}, não só o do upload.
+    caminho = _caminho_importacao(progresso["id"])
+    temporario = f"{caminho}.{os.getpid()}.tmp"
+    try:
+        with open(temporario, "w") as arquivo:
+            json.dump(progresso, arquivo)
+        os.replace(temporario, caminho)
+    except OSError as e:
+        logger.warning(f"Erro ao gravar progresso da importação {progresso['id']}: {e}")
+
+
+def ler_progresso(importacao_id):
+    # O id vira nome de arquivo: só aceita o uuid hex gerado em nova_importacao.
+    if len(importacao_id) != 32 or not all(c in "0123456789abcdef" for c in importacao_id):
+        return None
+    try:
+        with open(_caminho_importacao(importacao_id)) as arquivo:
+            return json.load(arquivo)
+    except (OSError, ValueError):
+        return None
+
+
+def _podar_importacoes():
+    try:
+        arquivos = sorted(
+            (e for e in os.scandir(IMPORTACOES_DIR) if e.name.endswith(".json")),
+            key=lambda e: e.stat().st_mtime,
+        )
+    except OSError:
+        return
+    for entrada in arquivos[: max(0, len(arquivos) - IMPORTACOES_MAX)]:
+        try:
+            os.remove(entrada.path)
+        except OSError:
+            pass
+
+
+def nova_importacao(arquivo: UploadFile):
+    progresso = {
+        "id": uuid.uuid4().hex,
+        "arquivo": arquivo.filename,
+        "status": "processando",
+        "linhas": 0,
+        "invalidos": 0,
+        "duplicados": 0,
+        "ceps_consultados": 0,
+        "registros": 0,
+        "iniciado_em": time.time(),
+        "duracao_s": None,
+    }
+    os.makedirs(IMPORTACOES_DIR, exist_ok=True)
+    salvar_progresso(progresso)
+    _podar_importacoes()
+    return progresso
+
+
+FONTES = ("bitrix", "mateus")
+FONTE_TIMEOUTS = {
+    fonte: float(os.getenv(f"FONTE_TIMEOUT_{fonte.upper()}", 10)) for fonte in FONTES
+}
+executor_fontes = ThreadPoolExecutor(
+    max_workers=int(os.getenv("FONTES_WORKERS", 8)), thread_name_prefix="fonte"
+)
+
+
+def formatar_mateus(rows):
+    with formatacao.cronometrar("mateus"):
+        return list(map(FORMATO_MATEUS, rows))
+
+
+CHAVES_FONTE = {
+    # public.geral não tem chave conhecida; ctid serve para paginar leituras.
+    "bitrix": (sql.SQL("t.id"), sql.SQL("%s")),
+    "mateus": (sql.SQL("t.ctid"), sql.SQL("%s::tid")),
+}
+
+
+def _posicao_fonte(valida):
+    # Em /search a posição é a chave em texto; False quando a fonte acabou e
+    # None quando ela ainda não respondeu.
+    return lambda posicao: posicao is None or posicao is False or (
+        isinstance(posicao, str) and posicao.isascii() and valida(posicao)
+    )
+
+
+def _ctid_valido(posicao):
+    # ctid em texto: "(bloco,linha)".
+    bloco, virgula, linha = posicao[1:-1].partition(",")
+    return (
+        posicao[:1] + posicao[-1:] == "()"
+        and bool(virgula)
+        and bloco.isdigit()
+        and linha.isdigit()
+    )
+
+
+POSICOES_FONTE = {
+    "bitrix": _posicao_fonte(str.isdigit),
+    "mateus": _posicao_fonte(_ctid_valido),
+}
+
+
+def select_from_database(
+    param: str, values: list, source: str, limit: int = None, depois=None
+):
+    # Todos os valores vão numa única consulta: o unnest vira o lado externo de
+    # um nested loop e cada padrão usa o índice trigram da coluna, em vez de
+    # uma varredura por valor. As duas primeiras colunas devolvem o valor que
+    # casou e a chave de paginação da fonte.
+    # A consulta é cortada no banco junto com o timeout da fonte, para não
+    # segurar conexão do pool depois que a resposta já saiu como parcial.
+    statement_timeout = int(FONTE_TIMEOUTS[source] * 1000)
+    valores = list(dict.fromkeys(values))
+    if not valores:
+        return []
+    padroes = [padrao_contem(valor) for valor in valores]
 
     match (source):
         case "bitrix":
@@ -328,79 +1226,140 @@ def select_from_database(param: str, value: str, source: str):
                 param = "uf_crm_numero"
             elif param in "uf":
                 param = "uf_crm_uf"
-
-            try:
-                conn = get_conn()
-                with conn.cursor() as curr:
-                    curr.execute(f"SELECT * FROM bitrix WHERE {param} LIKE '%{value}%'")
-                    rows = curr.fetchall()
-            except Exception as e:
-                print(e)
-            finally:
-                if conn is not None:
-                    conn.close()
-                return rows
+            tabela = sql.Identifier("bitrix")
+            abrir_conexao = get_conn
 
         case "mateus":
-            try:
-                conn = get_conn_mateus()
-                with conn.cursor() as curr:
-                    curr.execute(
-                        f"SELECT * FROM public.geral WHERE {param} LIKE '%{value}%'"
-                    )
-                    print(f"SELECT * FROM public.geral WHERE {param} LIKE '%{value}%'")
-                    rows = curr.fetchall()
-            except Exception as e:
-                print(f"ERRO AAAAAQ : {e}")
-            finally:
-                if conn is not None:
-                    conn.close()
-                list = []
-
-                print(rows)
-
-                for row in rows:
-                    list.append(
-                        {
-                            "cpf": row[0],
-                            "nome_do_cliente": row[1],
-                            "contato01": row[2],
-                            "rua": row[3],
-                            "uf_crm_numero": row[4],
-                            "uf_crm_bairro": row[5],
-                            "uf_crm_cep": row[6],
-                            "uf_crm_cidade": row[7],
-                            "uf_crm_uf": row[8],
-                            "email": row[9],
-                            "base": row[10],
-                        }
-                    )
-                return list
+            tabela = sql.SQL("public.geral")
+            abrir_conexao = get_conn_mateus
+
+    chave, placeholder = CHAVES_FONTE[source]
+    args = [valores, padroes]
+    keyset = sql.SQL("")
+    if depois is not None:
+        keyset = sql.SQL("WHERE {} > {}").format(chave, placeholder)
+        args.append(depois)
+    # Paginado (um valor só, em /search): ordena pela chave para o keyset.
+    ordem = sql.SQL("v.ordem") if limit is None else chave
+    limite = sql.SQL("")
+    if limit is not None:
+        limite = sql.SQL("LIMIT %s")
+        args.append(limit)
+
+    query = sql.SQL(
+        """
+        SELECT v.valor, {chave}::text, t.*
+        FROM unnest(%s::text[], %s::text[]) WITH ORDINALITY AS v(valor, padrao, ordem)
+        JOIN {tabela} t ON t.{coluna} LIKE v.padrao
+        {keyset}
+        ORDER BY {ordem}
+        {limite}
+        """
+    ).format(
+        chave=chave,
+        tabela=tabela,
+        coluna=sql.Identifier(param),
+        keyset=keyset,
+        ordem=ordem,
+        limite=limite,
+    )
 
+    with abrir_conexao() as conn:
+        with conn.cursor() as curr:
+            curr.execute("SET LOCAL statement_timeout = %s", (statement_timeout,))
+        with conn.cursor(name=f"select_{source}") as curr:
+            curr.itersize = limit or EXPORT_CHUNK
+            with db_etapa.cronometrar(source, "execute"):
+                curr.execute(query, args)
+            with db_etapa.cronometrar(source, "fetch"):
+                return curr.fetchall()
 
-@app.get("/search/{param}/{value}")
-def search(param: str, value: str):
-    param = param.strip()
-    value = value.upper()
+
+def consultar_fonte(
+    param: str, values: list, source: str, limit: int = None, depois=None
+):
+    rows = select_from_database(
+        param=param, values=values, source=source, limit=limit, depois=depois
+    )
+    linhas = [r[2:] for r in rows]
+    if source == "bitrix":
+        result = montar_resultado(linhas)
+    else:
+        result = formatar_mateus(linhas)
+    for r, resultado in zip(rows, result):
+        resultado["valor_busca"] = r[0]
+    ultima_chave = rows[-1][1] if rows else None
+    return result, ultima_chave
+
+
+def consultar_fontes(param: str, values: list, limit: int = None, cursor: str = None):
+    """Consulta todas as FONTES em paralelo, cada uma com seu próprio timeout.
+
+    Fonte lenta ou fora do ar não derruba a resposta: entra como ``timeout`` ou
+    ``erro`` em ``fontes`` e a resposta sai com ``parcial`` verdadeiro. Com
+    ``limit``, cada fonte devolve até ``limit`` linhas e ``proximo_cursor``
+    guarda a posição de cada uma (``False`` quando a fonte acabou).
+    """
+    posicoes = decodificar_cursor(cursor, POSICOES_FONTE)
+    inicio = time.monotonic()
+    futuros = {
+        # copy_context: os tempos da fonte entram no log da requisição.
+        fonte: executor_fontes.submit(
+            contextvars.copy_context().run,
+            consultar_fonte,
+            param,
+            values,
+            fonte,
+            limit,
+            posicoes.get(fonte),
+        )
+        for fonte in FONTES
+        if posicoes.get(fonte) is not False
+    }
     result = []
-    sources = ["bitrix", "mateus"]
+    status = {}
+    proximo = {}
+    for fonte, futuro in futuros.items():
+        restante = max(0, inicio + FONTE_TIMEOUTS[fonte] - time.monotonic())
+        # Em falha a fonte mantém a posição, para a próxima página tentar de novo.
+        proximo[fonte] = posicoes.get(fonte)
+        try:
+            linhas, ultima_chave = futuro.result(timeout=restante)
+            result.extend(linhas)
+            status[fonte] = "ok"
+            if limit is not None:
+                proximo[fonte] = ultima_chave if len(linhas) == limit else False
+        except FuturesTimeout:
+            futuro.cancel()
+            status[fonte] = "timeout"
+            logger.warning(f"Fonte {fonte} excedeu {FONTE_TIMEOUTS[fonte]}s")
+        except Exception as e:
+            status[fonte] = "erro"
+            logger.error(f"Erro ao consultar fonte {fonte}: {e}")
+
+    proximo_cursor = None
+    if limit is not None and any(p is not False for p in proximo.values()):
+        proximo_cursor = codificar_cursor(
+            {fonte: proximo.get(fonte, False) for fonte in FONTES}
+        )
 
-    for source in sources:
-        if source == "bitrix":
-            bitrix_results = montar_resultado(
-                select_from_database(param=param, value=value, source=source)
-            )
-            result.extend(bitrix_results)
-            
+    anotar(fontes=status, linhas=len(result))
+    return {
+        "total": len(result) if not cursor and proximo_cursor is None else None,
+        "parcial": any(s != "ok" for s in status.values()),
+        "fontes": status,
+        "resultados": result,
+        "proximo_cursor": proximo_cursor,
+    }
 
-        else:
-            mateus_results = select_from_database(
-                param=param, value=value, source=source
-            )
-            result.extend(mateus_results)
-           
 
-    return result
+@app.get("/search/{param}/{value}")
+def search(param: str, value: str, limit: int = PAGINA_PADRAO, cursor: str = None):
+    param, value, limit = param.strip(), value.upper(), limitar_pagina(limit)
+    return resposta_cacheada(
+        ("search", param, value, limit, cursor),
+        lambda: consultar_fontes(param, [value], limit, cursor),
+    )
 
 from typing import List
 
@@ -411,51 +1370,319 @@ class SearchRequest(BaseModel):
 
 @app.post("/search-amount/{param}")
 def search_amount (param: str, values: SearchRequest) :
-    sources = ["bitrix", "mateus"]
-    result = []
-
-    for value in values.values :
-        value = value.upper()
-        for source in sources :
-            if source == "bitrix":
-                bitrix_results = montar_resultado(
-                    select_from_database(param=param, value=value, source=source)
-                )
-                result.extend(bitrix_results)
-                
+    anotar(valores=len(values.values))
+    return RespostaJSON(
+        consultar_fontes(param, [value.upper() for value in values.values])
+    )
 
-            else:
-                mateus_results = select_from_database(
-                    param=param, value=value, source=source
-                )
-                result.extend(mateus_results)
 
-    print(result)
-    return result
+def resposta_coluna(coluna, valor, limit, cursor, total):
+    valor, limit = valor.strip(), limitar_pagina(limit)
+    return resposta_cacheada(
+        ("coluna", coluna, valor, limit, cursor, total),
+        lambda: buscar_por_coluna(coluna, valor, limit, cursor, total),
+    )
 
 
 @app.get("/buscar-rua")
-def buscar_rua_endpoint(rua: str):
-    resultados = buscar_por_rua(rua)
-    return {"total": len(resultados), "resultados": resultados}
+def buscar_rua_endpoint(
+    rua: str, limit: int = PAGINA_PADRAO, cursor: str = None, total: bool = False
+):
+    return resposta_coluna("rua", rua, limit, cursor, total)
 
 
 @app.get("/buscar-bairro")
-def buscar_bairro_endpoint(bairro: str):
-    resultados = buscar_por_bairro(bairro)
-    return {"total": len(resultados), "resultados": resultados}
+def buscar_bairro_endpoint(
+    bairro: str, limit: int = PAGINA_PADRAO, cursor: str = None, total: bool = False
+):
+    return resposta_coluna("uf_crm_bairro", bairro, limit, cursor, total)
 
 
 @app.get("/buscar-cidade")
-def buscar_cidade_endpoint(cidade: str):
-    resultados = buscar_por_cidade(cidade)
-    return {"total": len(resultados), "resultados": resultados}
+def buscar_cidade_endpoint(
+    cidade: str, limit: int = PAGINA_PADRAO, cursor: str = None, total: bool = False
+):
+    return resposta_coluna("uf_crm_cidade", cidade, limit, cursor, total)
 
 
 @app.get("/buscar-estado")
-def buscar_estado_endpoint(estado: str):
-    resultados = buscar_por_estado(estado)
-    return {"total": len(resultados), "resultados": resultados}
+def buscar_estado_endpoint(
+    estado: str, limit: int = PAGINA_PADRAO, cursor: str = None, total: bool = False
+):
+    return resposta_coluna("uf_crm_uf", estado, limit, cursor, total)
+
+
+CEP_INDICE_TTL = int(os.getenv("CEP_INDICE_TTL", 600))
+MATEUS_COLUNA_CEP = os.getenv("MATEUS_COLUNA_CEP", "cep")
+
+
+def _carregar_indice_ceps(fonte):
+    # Índice ordenado de CEPs (8 dígitos) com contagens acumuladas: qualquer
+    # faixa vira duas buscas binárias e uma subtração.
+    if fonte == "bitrix":
+        abrir_conexao = get_conn
+        query = sql.SQL(
+            "SELECT cep_normalizado, count(*) FROM bitrix "
+            "WHERE cep_normalizado IS NOT NULL GROUP BY 1"
+        )
+    else:
+        abrir_conexao = get_conn_mateus
+        query = sql.SQL(
+            "SELECT regexp_replace({coluna}, '[^0-9]', '', 'g'), count(*) "
+            "FROM public.geral WHERE {coluna} IS NOT NULL GROUP BY 1"
+        ).format(coluna=sql.Identifier(MATEUS_COLUNA_CEP))
+
+    contagens = {}
+    with abrir_conexao() as conn:
+        with conn.cursor() as cur:
+            cur.execute(query)
+            for cep, quantidade in cur:
+                if cep and len(cep) <= 8:
+                    cep = cep.zfill(8)
+                    contagens[cep] = contagens.get(cep, 0) + quantidade
+
+    ceps = sorted(contagens)
+    acumulado = [0]
+    for cep in ceps:
+        acumulado.append(acumulado[-1] + contagens[cep])
+    return {"ceps": ceps, "acumulado": acumulado}
+
+
+cache_indice_ceps = CacheTTL("indice_ceps", _carregar_indice_ceps, ttl=CEP_INDICE_TTL)
+
+
+def faixa_de_ceps(prefixo=None, inicio=None, fim=None):
+    if prefixo is not None:
+        inicio = fim = prefixo
+    digitos_inicio = normalizar_cep(inicio) or ""
+    digitos_fim = normalizar_cep(fim) or ""
+    if not digitos_inicio or not digitos_fim:
+        raise HTTPException(
+            status_code=400, detail="Informe prefixo ou inicio e fim do CEP."
+        )
+    if len(digitos_inicio) > 8 or len(digitos_fim) > 8:
+        raise HTTPException(status_code=400, detail="CEP com mais de 8 dígitos.")
+    inicio = digitos_inicio.ljust(8, "0")
+    fim = digitos_fim.ljust(8, "9")
+    if inicio > fim:
+        raise HTTPException(status_code=400, detail="Início da faixa maior que o fim.")
+    return inicio, fim
+
+
+def contar_faixa_ceps(inicio, fim, limit):
+    fontes = {}
+    por_cep = {}
+    for fonte in FONTES:
+        indice = cache_indice_ceps.get(fonte)
+        ceps = indice.get("ceps", [])
+        acumulado = indice.get("acumulado", [0])
+        i = bisect.bisect_left(ceps, inicio)
+        j = bisect.bisect_right(ceps, fim)
+        fontes[fonte] = {
+            "deals": acumulado[j] - acumulado[i],
+            "ceps_distintos": j - i,
+            "disponivel": bool(indice),
+        }
+        # Os primeiros ``limit`` CEPs de cada fonte bastam para os primeiros
+        # ``limit`` da união.
+        for k in range(i, min(j, i + limit)):
+            por_cep.setdefault(ceps[k], {})[fonte] = acumulado[k + 1] - acumulado[k]
+
+    return {
+        "inicio": inicio,
+        "fim": fim,
+        "total": sum(f["deals"] for f in fontes.values()),
+        "fontes": fontes,
+        "ceps": [
+            {"cep": cep, **por_cep[cep]} for cep in sorted(por_cep)[:limit]
+        ],
+    }
+
+
+@app.get("/ceps/faixa")
+def ceps_faixa_endpoint(
+    prefixo: str = None, inicio: str = None, fim: str = None, limit: int = 100
+):
+    inicio, fim = faixa_de_ceps(prefixo, inicio, fim)
+    resultado = contar_faixa_ceps(inicio, fim, limitar_pagina(limit))
+    anotar(linhas=len(resultado["ceps"]))
+    return RespostaJSON(resultado)
+
+
+EVENTOS_JANELA = float(os.getenv("BITRIX_EVENTOS_JANELA", 2))
+EVENTOS_LOTE = int(os.getenv("BITRIX_EVENTOS_LOTE", 500))
+EVENTOS_RETRY = float(os.getenv("BITRIX_EVENTOS_RETRY", 10))
+BITRIX_EVENTOS_TOKEN = os.getenv("BITRIX_EVENTOS_TOKEN")
+EVENTOS_DEAL = {
+    "ONCRMDEALADD": "gravar",
+    "ONCRMDEALUPDATE": "gravar",
+    "ONCRMDEALDELETE": "apagar",
+}
+
+bitrix_eventos = registro.contador(
+    "cep_bitrix_eventos_total", "Eventos recebidos do Bitrix.", ("evento",)
+)
+
+
+class FilaEventos:
+    """IDs de deals vindos dos eventos do Bitrix, coalescidos por janela.
+
+    O primeiro evento abre uma janela de ``janela`` segundos; o que chega nela
+    vai num único lote, e vários eventos do mesmo deal viram um só (vale o
+    último). Uma thread processa os lotes; se falhar, os IDs voltam para a fila.
+    """
+
+    def __init__(self, processar, janela=EVENTOS_JANELA, lote=EVENTOS_LOTE):
+        self._processar = processar
+        self._janela = janela
+        self._lote = lote
+        self._pendentes = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+        self.stats = {
+            "eventos": 0,
+            "coalescidos": 0,
+            "lotes": 0,
+            "erros": 0,
+            "alterados": 0,
+            "inalterados": 0,
+            "removidos": 0,
+            "ausentes": 0,
+        }
+
+    def enfileirar(self, deal_id, acao):
+        with self._cond:
+            self.stats["eventos"] += 1
+            if deal_id in self._pendentes:
+                self.stats["coalescidos"] += 1
+                self._pendentes.move_to_end(deal_id)
+            self._pendentes[deal_id] = acao
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._trabalhar, name="eventos_bitrix", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+
+    def _proximo_lote(self):
+        with self._cond:
+            while not self._pendentes:
+                self._cond.wait()
+            cheio = len(self._pendentes) >= self._lote
+        if not cheio:
+            time.sleep(self._janela)
+        with self._cond:
+            n = min(self._lote, len(self._pendentes))
+            return dict(self._pendentes.popitem(last=False) for _ in range(n))
+
+    def _trabalhar(self):
+        while True:
+            lote = self._proximo_lote()
+            try:
+                resultado = self._processar(lote)
+            except Exception as e:
+                logger.error(f"Erro ao processar {len(lote)} eventos do Bitrix: {e}")
+                with self._cond:
+                    self.stats["erros"] += 1
+                    for deal_id, acao in lote.items():
+                        # Um evento mais novo do mesmo deal prevalece.
+                        self._pendentes.setdefault(deal_id, acao)
+                time.sleep(EVENTOS_RETRY)
+                continue
+            with self._cond:
+                self.stats["lotes"] += 1
+                for chave, valor in resultado.items():
+                    self.stats[chave] += valor
+
+    def info(self):
+        with self._cond:
+            return {**self.stats, "pendentes": len(self._pendentes), "janela": self._janela}
+
+
+def _carregar_metadados_sync(_chave=None):
+    categorias, estagios, operadoras = carregar_metadados()
+    if not categorias:
+        raise RuntimeError("categorias do Bitrix indisponíveis")
+    return categorias, estagios, operadoras
+
+
+# Mesmos mapas do sync (crm.dealcategory.list), não os de /stats["metadados"].
+cache_metadados_sync = CacheTTL("metadados_sync", _carregar_metadados_sync)
+_schema_eventos = threading.Event()
+
+
+def processar_eventos(lote):
+    metadados = cache_metadados_sync.get()
+    if not metadados:
+        raise RuntimeError("metadados do Bitrix indisponíveis")
+    gravar = [deal_id for deal_id, acao in lote.items() if acao == "gravar"]
+    apagar = [deal_id for deal_id, acao in lote.items() if acao == "apagar"]
+    if not _schema_eventos.is_set():
+        with get_conn() as conn:
+            garantir_schema(conn)
+        _schema_eventos.set()
+    # A conexão do pool só é pedida depois da busca no Bitrix, que pode demorar.
+    resultado = sincronizar_deals(get_conn, gravar, apagar, metadados)
+    logger.info(f"Eventos do Bitrix: {len(lote)} deals, {resultado}")
+    return resultado
+
+
+fila_eventos = FilaEventos(processar_eventos)
+
+
+@app.post("/bitrix/eventos")
+async def bitrix_eventos_endpoint(request: Request):
+    # Webhook de saída do Bitrix: corpo form-urlencoded com event,
+    # data[FIELDS][ID] e auth[application_token].
+    # Sem token configurado o endpoint fica fechado: um ONCRMDEALDELETE
+    # qualquer apagaria linhas da tabela bitrix.
+    if not BITRIX_EVENTOS_TOKEN:
+        raise HTTPException(
+            status_code=503, detail="Eventos desabilitados: defina BITRIX_EVENTOS_TOKEN."
+        )
+    # Corpo que não é UTF-8 não derruba o endpoint: cai no token inválido.
+    campos = dict(parse_qsl((await request.body()).decode(errors="replace")))
+    token = campos.get("auth[application_token]", "")
+    if not secrets.compare_digest(token.encode(), BITRIX_EVENTOS_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="application_token inválido")
+    evento = campos.get("event", "").upper()
+    acao = EVENTOS_DEAL.get(evento)
+    deal_id = campos.get("data[FIELDS][ID]")
+    bitrix_eventos.incrementar(evento if acao else "ignorado")
+    anotar(evento=evento, deal_id=deal_id)
+    if acao is None or not deal_id:
+        return {"status": "ignorado"}
+    if not (deal_id.isascii() and deal_id.isdigit()):
+        raise HTTPException(status_code=400, detail="data[FIELDS][ID] inválido")
+    fila_eventos.enfileirar(deal_id, acao)
+    return {"status": "enfileirado"}
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    return Response(
+        content=registro.exportar(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@app.get("/stats")
+def stats_endpoint():
+    return {
+        "metadados": {
+            "categorias": cache_categorias.info(),
+            "stages": cache_stages.info(),
+            "indice_ceps": cache_indice_ceps.info(),
+            "sync": cache_metadados_sync.info(),
+        },
+        "eventos": fila_eventos.info(),
+        "resultados": cache_resultados.info(),
+        "log_acesso": log_acesso.info(),
+        "pools": {
+            "bitrix": pool_bitrix.info(),
+            "mateus": pool_mateus.info(),
+        },
+        "snapshot": leitor_snapshot.info(),
+    }
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -463,6 +1690,14 @@ async def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 
+@app.get("/buscar/progresso/{importacao_id}")
+def progresso_importacao(importacao_id: str):
+    progresso = ler_progresso(importacao_id)
+    if progresso is None:
+        raise HTTPException(status_code=404, detail="Importação não encontrada.")
+    return progresso
+
+
 @app.post("/buscar")
 async def buscar(
     cep: str = Form(None),
@@ -476,40 +1711,34 @@ async def buscar(
         )
 
     if arquivo and arquivo.filename != "":
-        ceps = await extrair_ceps_arquivo(arquivo)
-        if not ceps:
+        progresso = nova_importacao(arquivo)
+        anotar(importacao=progresso["id"], formato=formato)
+        ceps = ceps_unicos(celulas_cep(arquivo), progresso)
+        primeiro = await run_in_threadpool(next, ceps, None)
+        if primeiro is None:
+            progresso["status"] = "vazio"
+            salvar_progresso(progresso)
             return JSONResponse(
                 content={"error": "Nenhum CEP encontrado no arquivo."},
                 status_code=400,
             )
 
-        resultados = buscar_varios_ceps(ceps)
-        if not resultados:
-            resultados = []
-
-        if formato == "xlsx":
-            df = pd.DataFrame(resultados)
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-                df.to_excel(tmp.name, index=False)
-                tmp.seek(0)
-                return FileResponse(
-                    tmp.name,
-                    media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    filename="resultado.xlsx",
-                )
-        else:
-            output = io.StringIO()
-            for res in resultados:
-                output.write(str(res) + "\n")
-            output.seek(0)
-            headers = {"Content-Disposition": 'attachment; filename="resultado.txt"'}
-            return StreamingResponse(output, media_type="text/plain", headers=headers)
+        exportar, media_type, filename = FORMATOS_EXPORT.get(
+            formato, FORMATOS_EXPORT["txt"]
+        )
+        headers = {
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            # Acompanhamento em GET /buscar/progresso/{id}.
+            "X-Importacao-Id": progresso["id"],
+        }
+        linhas = consultar_lotes_ceps(chain([primeiro], ceps), progresso)
+        return StreamingResponse(
+            exportar(linhas), media_type=media_type, headers=headers
+        )
 
     elif cep:
-        resultados = buscar_por_cep(cep)
-        return JSONResponse(
-            content={"total": len(resultados), "resultados": resultados}
-        )
+        anotar(cep=normalizar_cep(cep))
+        return resposta_cep(cep)
 
     else:
         return JSONResponse(
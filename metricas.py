@@ -0,0 +1,161 @@
+import bisect
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+# Histogramas e contadores no formato de texto do Prometheus, sem dependência
+# externa. Registrar uma medida custa um bisect e duas somas sob um lock; o
+# texto só é montado quando alguém consulta /metrics.
+
+# Acumulador de tempos por etapa da requisição em andamento (ver o log de
+# acesso); fora de uma requisição fica None e nada é acumulado.
+etapas_atuais = ContextVar("etapas_atuais", default=None)
+
+BUCKETS_PADRAO = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _rotulos(nomes, valores, extra=""):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _numero(valor):
+    return repr(float(valor)) if valor != float("inf") else "+Inf"
+
+
+class Histograma:
+    tipo = "histogram"
+
+    def __init__(self, nome, ajuda, rotulos=(), buckets=BUCKETS_PADRAO):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.buckets = tuple(buckets)
+        # cep_db_segundos -> "db": prefixo das etapas no log de acesso.
+        self.curto = nome.removeprefix("cep_").removesuffix("_segundos")
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observar(self, valor, *rotulos):
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(rotulos)
+            if serie is None:
+                serie = self._series[rotulos] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][i] += 1
+            serie[1] += valor
+        etapas = etapas_atuais.get()
+        if etapas is not None:
+            chave = ".".join((self.curto,) + rotulos)
+            etapas[chave] = etapas.get(chave, 0.0) + valor
+
+    def cronometrar(self, *rotulos):
+        return _Cronometro(self, rotulos)
+
+    def linhas(self):
+        with self._lock:
+            series = [(r, list(c), s) for r, (c, s) in self._series.items()]
+        for rotulos, contagens, soma in sorted(series):
+            acumulado = 0
+            for limite, n in zip(self.buckets + (float("inf"),), contagens):
+                acumulado += n
+                le = f'le="{_numero(limite)}"'
+                yield f"{self.nome}_bucket{_rotulos(self.rotulos, rotulos, le)} {acumulado}"
+            yield f"{self.nome}_sum{_rotulos(self.rotulos, rotulos)} {soma}"
+            yield f"{self.nome}_count{_rotulos(self.rotulos, rotulos)} {acumulado}"
+
+
+class _Cronometro:
+    # Classe em vez de @contextmanager: sem gerador, custa um terço.
+    __slots__ = ("_histograma", "_rotulos", "_inicio")
+
+    def __init__(self, histograma, rotulos):
+        self._histograma = histograma
+        self._rotulos = rotulos
+
+    def __enter__(self):
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histograma.observar(time.perf_counter() - self._inicio, *self._rotulos)
+        return False
+
+
+class Contador:
+    tipo = "counter"
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def incrementar(self, *rotulos, valor=1):
+        with self._lock:
+            self._series[rotulos] = self._series.get(rotulos, 0) + valor
+
+    def linhas(self):
+        with self._lock:
+            series = sorted(self._series.items())
+        for rotulos, valor in series:
+            yield f"{self.nome}{_rotulos(self.rotulos, rotulos)} {valor}"
+
+
+class Registro:
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def _registrar(self, classe, nome, *args, **kwargs):
+        with self._lock:
+            metrica = self._metricas.get(nome)
+            if metrica is None:
+                metrica = self._metricas[nome] = classe(nome, *args, **kwargs)
+            return metrica
+
+    def histograma(self, nome, ajuda, rotulos=(), buckets=BUCKETS_PADRAO):
+        return self._registrar(Histograma, nome, ajuda, rotulos, buckets)
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self._registrar(Contador, nome, ajuda, rotulos)
+
+    def exportar(self):
+        with self._lock:
+            metricas = list(self._metricas.values())
+        saida = []
+        for metrica in metricas:
+            saida.append(f"# HELP {metrica.nome} {metrica.ajuda}")
+            saida.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+            saida.extend(metrica.linhas())
+        return "\n".join(saida) + "\n"
+
+    def gravar(self, caminho):
+        # Para processos sem HTTP (o sync): arquivo no formato do textfile
+        # collector do node_exporter, trocado atomicamente.
+        os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+        temporario = f"{caminho}.{os.getpid()}.tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            f.write(self.exportar())
+        os.replace(temporario, caminho)
+
+
+registro = Registro()
+
+# Métricas compartilhadas pelo main.py e pelo atualizar_cache.py.
+bitrix_http = registro.histograma(
+    "cep_bitrix_http_segundos",
+    "Duração das chamadas HTTP ao Bitrix.",
+    ("metodo", "status"),
+)
@@ -0,0 +1,339 @@
+import fcntl
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+
+# Snapshot local (SQLite) das colunas pesquisáveis da tabela bitrix.
+#
+# O sync completo grava um arquivo novo ao lado e troca com os.replace, que é
+# atômico; os leitores percebem a troca pelo inode e reabrem. Entre dois
+# completos, o incremental e os eventos do Bitrix aplicam só as linhas alteradas
+# no próprio arquivo (aplicar_no_snapshot). Publicação e aplicação passam por
+# um flock no arquivo .lock, então nenhuma alteração cai no arquivo que está
+# sendo substituído. Se uma aplicação falha, o arquivo é removido
+# (invalidar_snapshot) e o próximo sync publica um novo. Os leitores abrem
+# somente-leitura e com mmap, então vários workers do uvicorn compartilham as
+# mesmas páginas pelo cache do sistema.
+
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "snapshot/bitrix.sqlite")
+SNAPSHOT_MMAP = int(os.getenv("SNAPSHOT_MMAP", 1024 * 1024 * 1024))
+FORMATO_SNAPSHOT = "5"
+
+
+def _texto(coluna):
+    # TRIM e NULL -> '' feitos no banco: a API só copia os valores para o dict.
+    return f'COALESCE(TRIM("{coluna}"::text), \'\')'
+
+
+# Mesma ordem de CAMPOS_BITRIX em main.py, mais "base" (que as buscas por
+# endereço devolvem) e a chave de CEP normalizada.
+COLUNAS_SNAPSHOT = [
+    ("id", '"id"'),
+    ("title", _texto("title")),
+    ("stage_id", _texto("stage_id")),
+    ("category_id", _texto("category_id")),
+    ("uf_crm_cep", _texto("uf_crm_cep")),
+    ("uf_crm_contato", _texto("uf_crm_contato")),
+    ("date_create", _texto("date_create")),
+    ("contato01", _texto("contato01")),
+    ("contato02", _texto("contato02")),
+    ("ordem_de_servico", _texto("ordem_de_servico")),
+    ("nome_do_cliente", _texto("nome_do_cliente")),
+    ("nome_da_mae", _texto("nome_da_mae")),
+    ("data_de_vencimento", _texto("data_de_vencimento")),
+    ("email", _texto("email")),
+    ("cpf", _texto("cpf")),
+    ("rg", _texto("rg")),
+    ("referencia", _texto("referencia")),
+    ("rua", _texto("rua")),
+    ("data_de_instalacao", _texto("data_de_instalacao")),
+    ("quais_operadoras_tem_viabilidade", _texto("quais_operadoras_tem_viabilidade")),
+    ("uf_crm_bairro", _texto("uf_crm_bairro")),
+    ("uf_crm_cidade", _texto("uf_crm_cidade")),
+    ("uf_crm_numero", _texto("uf_crm_numero")),
+    ("uf_crm_uf", _texto("uf_crm_uf")),
+    ("base", _texto("base")),
+    ("cep_normalizado", '"cep_normalizado"'),
+]
+
+COLUNAS_ENDERECO = ["rua", "uf_crm_bairro", "uf_crm_cidade", "uf_crm_uf"]
+# O LIKE do SQLite e o trigram do FTS5 só ignoram caixa em ASCII ("são" não
+# casa "SÃO"); cada coluna de endereço ganha uma cópia em minúsculas, e a
+# busca compara minúsculas com minúsculas, como o ILIKE do Postgres.
+COLUNAS_BUSCA = [f"{coluna}_busca" for coluna in COLUNAS_ENDERECO]
+
+_CAMPOS = [nome for nome, _ in COLUNAS_SNAPSHOT]
+_CAMPOS_RESULTADO = ", ".join(f"d.{c}" for c in _CAMPOS[:-1])
+_INDICES_ENDERECO = [_CAMPOS.index(coluna) for coluna in COLUNAS_ENDERECO]
+
+
+def _valor_sqlite(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if valor is None or isinstance(valor, (str, int, float)):
+        return valor
+    return str(valor)
+
+
+def _linha_sqlite(row):
+    valores = tuple(map(_valor_sqlite, row))
+    return valores + tuple((valores[i] or "").lower() for i in _INDICES_ENDERECO)
+
+
+_SQL_SELECT = "SELECT " + ", ".join(expr for _, expr in COLUNAS_SNAPSHOT) + " FROM bitrix"
+_SQL_INSERT = (
+    f"INSERT INTO deals VALUES ({', '.join('?' * (len(_CAMPOS) + len(COLUNAS_BUSCA)))})"
+)
+
+
+@contextmanager
+def _trava(caminho):
+    os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+    with open(f"{caminho}.lock", "a") as arquivo:
+        fcntl.flock(arquivo, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(arquivo, fcntl.LOCK_UN)
+
+
+def snapshot_atual(caminho=SNAPSHOT_PATH):
+    """True se existe snapshot no formato desta versão do código."""
+    if not os.path.exists(caminho):
+        return False
+    try:
+        conn = sqlite3.connect(f"file:{caminho}?mode=ro", uri=True)
+        try:
+            row = conn.execute("SELECT valor FROM meta WHERE chave = 'formato'").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+    return row is not None and row[0] == FORMATO_SNAPSHOT
+
+
+def aplicar_no_snapshot(conectar, ids, caminho=SNAPSHOT_PATH):
+    """Regrava no snapshot só as linhas ``ids``, lidas do Postgres.
+
+    ``conectar()`` devolve um context manager com a conexão do Postgres; ela só
+    é pedida depois do flock, e a leitura feita sob ele, então o snapshot fica
+    com o estado mais recente já commitado. IDs que não existem mais no
+    Postgres saem do snapshot. Sem snapshot atual não faz nada e devolve None.
+    """
+    ids = [str(i) for i in ids]
+    if not ids or not snapshot_atual(caminho):
+        return None
+    with _trava(caminho):
+        if not snapshot_atual(caminho):
+            return None
+        with conectar() as conn_pg:
+            with conn_pg.cursor() as cur:
+                cur.execute(_SQL_SELECT + " WHERE id IN %s", (tuple(ids),))
+                rows = cur.fetchall()
+            conn_pg.commit()
+        sl = sqlite3.connect(caminho)
+        try:
+            with sl:
+                # SQLite limita o número de parâmetros por consulta.
+                for i in range(0, len(ids), 500):
+                    grupo = ids[i : i + 500]
+                    sl.execute(
+                        f"DELETE FROM deals WHERE id IN ({', '.join('?' * len(grupo))})",
+                        grupo,
+                    )
+                sl.executemany(_SQL_INSERT, [_linha_sqlite(r) for r in rows])
+        finally:
+            sl.close()
+    return len(rows)
+
+
+def invalidar_snapshot(caminho=SNAPSHOT_PATH):
+    """Remove o snapshot; os leitores voltam para o Postgres.
+
+    Usado quando uma alteração já commitada no Postgres não chegou ao snapshot:
+    melhor nenhum snapshot que um desatualizado até o próximo sync publicar.
+    """
+    with _trava(caminho):
+        try:
+            os.remove(caminho)
+        except FileNotFoundError:
+            pass
+
+
+def publicar_snapshot(conn_pg, caminho=SNAPSHOT_PATH, lote=5000):
+    """Exporta a tabela bitrix do Postgres e publica o snapshot atomicamente."""
+    with _trava(caminho):
+        return _publicar(conn_pg, caminho, lote)
+
+
+def _publicar(conn_pg, caminho, lote):
+    inicio = time.monotonic()
+    temporario = f"{caminho}.{os.getpid()}.tmp"
+    if os.path.exists(temporario):
+        os.remove(temporario)
+
+    sl = sqlite3.connect(temporario)
+    try:
+        sl.execute("PRAGMA journal_mode = OFF")
+        sl.execute("PRAGMA synchronous = OFF")
+        colunas = ", ".join(
+            "id INTEGER PRIMARY KEY" if nome == "id" else f"{nome} TEXT"
+            for nome in _CAMPOS + COLUNAS_BUSCA
+        )
+        sl.execute(f"CREATE TABLE deals ({colunas})")
+        sl.execute("CREATE TABLE meta (chave TEXT PRIMARY KEY, valor TEXT)")
+
+        linhas = 0
+        with conn_pg.cursor(name="publicar_snapshot") as cur:
+            cur.itersize = lote
+            cur.execute(_SQL_SELECT)
+            while True:
+                rows = cur.fetchmany(lote)
+                if not rows:
+                    break
+                sl.executemany(_SQL_INSERT, [_linha_sqlite(r) for r in rows])
+                linhas += len(rows)
+        conn_pg.commit()
+
+        sl.execute("CREATE INDEX idx_deals_cep ON deals (cep_normalizado)")
+        try:
+            # Índice trigram para LIKE '%x%' nas colunas de endereço.
+            sl.execute(
+                f"CREATE VIRTUAL TABLE enderecos USING fts5("
+                f"{', '.join(COLUNAS_BUSCA)}, content='deals', content_rowid='id', "
+                f"tokenize='trigram')"
+            )
+            sl.execute("INSERT INTO enderecos(enderecos) VALUES ('rebuild')")
+            # Mantêm o índice em dia quando aplicar_no_snapshot troca linhas.
+            colunas = ", ".join(COLUNAS_BUSCA)
+            velhos = ", ".join(f"old.{c}" for c in COLUNAS_BUSCA)
+            novos = ", ".join(f"new.{c}" for c in COLUNAS_BUSCA)
+            sl.execute(
+                f"CREATE TRIGGER deals_ad AFTER DELETE ON deals BEGIN "
+                f"INSERT INTO enderecos(enderecos, rowid, {colunas}) "
+                f"VALUES ('delete', old.id, {velhos}); END"
+            )
+            sl.execute(
+                f"CREATE TRIGGER deals_ai AFTER INSERT ON deals BEGIN "
+                f"INSERT INTO enderecos(rowid, {colunas}) VALUES (new.id, {novos}); END"
+            )
+            fts = "1"
+        except sqlite3.OperationalError:
+            fts = "0"
+
+        versao = datetime.now().strftime("%Y%m%d%H%M%S")
+        sl.executemany(
+            "INSERT INTO meta VALUES (?, ?)",
+            [
+                ("formato", FORMATO_SNAPSHOT),
+                ("versao", versao),
+                ("linhas", str(linhas)),
+                ("fts", fts),
+            ],
+        )
+        sl.commit()
+        # Journal normal a partir daqui, para as aplicações incrementais.
+        sl.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        sl.close()
+
+    os.replace(temporario, caminho)
+    print(
+        f"📦 Snapshot {versao} publicado: {linhas} linhas em "
+        f"{time.monotonic() - inicio:.1f}s ({caminho})"
+    )
+    return versao
+
+
+class LeitorSnapshot:
+    """Consultas somente-leitura ao snapshot, com uma conexão por thread.
+
+    A cada consulta confere inode e mtime do arquivo; se o sync publicou um
+    novo ou aplicou alterações, a conexão é reaberta. Sem arquivo (ou com formato diferente) ``disponivel``
+    devolve False e o chamador segue para o Postgres.
+    """
+
+    def __init__(self, caminho=SNAPSHOT_PATH):
+        self.caminho = caminho
+        self._local = threading.local()
+
+    def _conexao(self):
+        try:
+            st = os.stat(self.caminho)
+        except FileNotFoundError:
+            return None
+        chave = (st.st_ino, st.st_mtime_ns)
+        local = self._local
+        if getattr(local, "chave", None) != chave:
+            if getattr(local, "conn", None) is not None:
+                local.conn.close()
+            conn = sqlite3.connect(
+                f"file:{self.caminho}?mode=ro",
+                uri=True,
+                check_same_thread=False,
+            )
+            conn.execute(f"PRAGMA mmap_size = {SNAPSHOT_MMAP}")
+            meta = dict(conn.execute("SELECT chave, valor FROM meta"))
+            if meta.get("formato") != FORMATO_SNAPSHOT:
+                conn.close()
+                conn, meta = None, {}
+            local.conn, local.meta, local.chave = conn, meta, chave
+        return local.conn
+
+    def disponivel(self):
+        return self._conexao() is not None
+
+    def info(self):
+        conn = self._conexao()
+        if conn is None:
+            return {"disponivel": False}
+        return {"disponivel": True, **self._local.meta}
+
+    def buscar_ceps(self, ceps):
+        conn = self._conexao()
+        ceps = list(ceps)
+        # SQLite limita o número de parâmetros por consulta.
+        for i in range(0, len(ceps), 500):
+            grupo = ceps[i : i + 500]
+            yield from conn.execute(
+                f"SELECT {_CAMPOS_RESULTADO} FROM deals d "
+                f"WHERE d.cep_normalizado IN ({', '.join('?' * len(grupo))})",
+                grupo,
+            )
+
+    def _filtro_contem(self, coluna, valor):
+        if coluna not in COLUNAS_ENDERECO:
+            raise ValueError(f"coluna sem índice no snapshot: {coluna}")
+        coluna, valor = f"{coluna}_busca", valor.lower()
+        if any(c in valor for c in "%_\\"):
+            padrao = valor.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            return f"d.{coluna} LIKE ? ESCAPE '\\'", f"%{padrao}%"
+        if self._local.meta.get("fts") == "1" and len(valor) >= 3:
+            return (
+                f"d.id IN (SELECT rowid FROM enderecos WHERE enderecos.{coluna} LIKE ?)",
+                f"%{valor}%",
+            )
+        return f"d.{coluna} LIKE ?", f"%{valor}%"
+
+    def buscar_contem(self, coluna, valor, limit, depois=None):
+        conn = self._conexao()
+        filtro, padrao = self._filtro_contem(coluna, valor)
+        args = [padrao]
+        if depois is not None:
+            filtro += " AND d.id > ?"
+            args.append(depois)
+        return conn.execute(
+            f"SELECT {_CAMPOS_RESULTADO} FROM deals d WHERE {filtro} "
+            f"ORDER BY d.id LIMIT ?",
+            args + [limit],
+        ).fetchall()
+
+    def contar_contem(self, coluna, valor):
+        conn = self._conexao()
+        filtro, padrao = self._filtro_contem(coluna, valor)
+        return conn.execute(
+            f"SELECT count(*) FROM deals d WHERE {filtro}", [padrao]
+        ).fetchone()[0]